@@ -0,0 +1,332 @@
+"""
+Offline benchmarks of the simulation and playback hot paths. No Discord token is needed:
+playback runs against :class:`FakeClient` and :class:`FakeContext`, which only record the edits they would send.
+
+Timings are compared with the baseline relative to :func:`calibrate`, so a baseline recorded on another machine,
+or on this one while it was busier, still applies.
+
+    python bench.py                 # run and compare with the stored baseline
+    python bench.py --save          # run and store the results as the new baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import dico
+import numpy as np
+
+from encoder import embedSize, screenFields
+from engine import Codes, Project, Simulation, Sprite, SpriteInProject, animate, colors
+from runtime import Runtime, TickDriver
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# metrics where a larger value is better; for every other metric smaller is better
+HIGHER_IS_BETTER = {"ticksPerSecond"}
+# metrics that depend on how fast the machine is, reported as if calibrate() had taken REFERENCE_SECONDS
+TIMINGS = {"ticksPerSecond", "compositeMicroseconds", "encodeMicroseconds", "animateMilliseconds"}
+REFERENCE_SECONDS = 0.025
+
+
+class FakeUser:
+    def __init__(self, id: int):
+        self.id = id
+
+    def __str__(self):
+        return f"bench#{self.id:04d}"
+
+
+class FakeContext:
+    """
+    Stands in for :class:`dico_interaction.InteractionContext`, recording every message it would send or edit.
+    """
+    def __init__(self, client: "FakeClient", id: int):
+        self.client = client
+        self.id = id
+        self.author = FakeUser(id)
+        self.channel_id = id
+        self.deferred = False
+        self.edits = 0
+        self.bytes = 0
+
+    async def record(self, kwargs: dict):
+        if self.client.latency:
+            await asyncio.sleep(self.client.latency)
+        size = payloadSize(kwargs)
+        self.edits += 1
+        self.bytes += size
+        self.client.edits.append((self.id, size))
+
+    async def send(self, content: str = None, **kwargs):
+        self.deferred = True
+        await self.record(dict(kwargs, content=content))
+
+    async def defer(self, ephemeral: bool = False, update_message: bool = False):
+        self.deferred = True
+
+    async def edit_original_response(self, **kwargs):
+        await self.record(kwargs)
+
+
+class FakeClient:
+    """
+    Stands in for :class:`dico.Client`: hands out contexts and collects their edits. ``latency`` delays each edit.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.edits = []
+        self.nextID = 1
+
+    def context(self) -> FakeContext:
+        ctx = FakeContext(self, self.nextID)
+        self.nextID += 1
+        return ctx
+
+
+def payloadSize(kwargs: dict) -> int:
+    """
+    Bytes of the JSON body an edit with ``kwargs`` would send.
+    """
+    data = {}
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        if key == "embed":
+            data["embeds"] = [value.to_dict()]
+        elif key == "components":
+            data[key] = [row.to_dict() for row in value]
+        else:
+            data[key] = value
+    return len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def randomSprite(rng: random.Random, name: str, density: float = 0.6) -> Sprite:
+    sprite = Sprite(name, [5, 5])
+    sprite.shape = [[rng.choice(list(colors)[1:]) if rng.random() < density else "blank" for _ in range(5)] for _ in range(5)]
+    return sprite
+
+
+def manySprites(count: int, seed: int = 0) -> Project:
+    """
+    ``count`` sprites spread over the screen, each wandering and turning on every tick.
+    """
+    rng = random.Random(seed)
+    sprites = []
+    for i in range(count):
+        code = Codes(
+            whenStarted=[Codes.moveTo([rng.randrange(10), rng.randrange(23)])],
+            whenUpdated=[Codes.move(rng.randrange(4), 1), Codes.turn(rng.randrange(1, 4)), Codes.move(rng.randrange(4), 1)]
+        )
+        sprites.append(SpriteInProject(randomSprite(rng, f"s{i}"), position=[0, 0], id=i, code=code))
+    return Project(f"{count} sprites", "black", sprites)
+
+
+def deepProgram(depth: int, seed: int = 0) -> Project:
+    """
+    One sprite whose whenUpdated is ``depth`` instructions long.
+    """
+    rng = random.Random(seed)
+    code = []
+    for i in range(depth):
+        kind = rng.randrange(5)
+        if kind == 0:
+            code.append(Codes.turn(rng.randrange(1, 4)))
+        elif kind == 1:
+            code.append(Codes.display(rng.random() < 0.2))
+        elif kind == 2:
+            code.append(Codes.moveTo([rng.randrange(10), rng.randrange(23)]))
+        else:
+            code.append(Codes.move(rng.randrange(4), rng.randrange(1, 4)))
+    sprite = SpriteInProject(randomSprite(rng, "deep"), position=[0, 0], id=0, code=Codes(whenUpdated=code))
+    return Project(f"{depth} instructions", "black", [sprite])
+
+
+def cloneHeavy(count: int, seed: int = 0, steps: int = 20) -> Project:
+    """
+    ``count`` sprites that each duplicate themselves on every tick, cycling through a few spawn points,
+    with clones that keep turning and moving one cell per tick for ``steps`` ticks and then hide, which releases them.
+    """
+    rng = random.Random(seed)
+    sprites = []
+    for i in range(count):
+        spawns = []
+        for _ in range(rng.randrange(3, 8)):
+            spawns += [Codes.duplicate([rng.randrange(10), rng.randrange(23)]), Codes.wait(1)]
+        direction = rng.randrange(4)
+        walk = []
+        for _ in range(steps):
+            walk += [Codes.turn(rng.randrange(1, 4)), Codes.move(direction, 1), Codes.wait(1)]
+        code = Codes(whenUpdated=spawns[:-1], whenDuplicated=walk + [Codes.display(True)])
+        sprites.append(SpriteInProject(randomSprite(rng, f"c{i}"), position=[0, 0], id=i, code=code))
+    return Project(f"{count} cloners", "black", sprites)
+
+
+scenarios = {
+    "sprites25": lambda: manySprites(25),
+    "deep500": lambda: deepProgram(500),
+    "clones5": lambda: cloneHeavy(5)
+}
+
+
+def playbackEmbed(project: Project) -> dico.Embed:
+    """
+    The embed ``/프로젝트 재생`` starts from.
+    """
+    embed = dico.Embed(title=f"{project.name} 프로젝트 재생", description=f"이름: {project.name}\nID: 0", color=0x00ff00)
+    embed.add_field(name="Screen", value="- " * 10)
+    project.redraw()
+    fields, size = screenFields(project.frame(), embedSize(embed))
+    for name, value in fields:
+        embed.add_field(name=name, value=value, inline=False)
+    return embed
+
+
+def benchSimulation(project: Project, ticks: int) -> dict:
+    simulation = Simulation(project)
+    stepping = 0.0
+    compositing = 0.0
+    frames = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        simulation.step()
+        middle = time.perf_counter()
+        frames.append(simulation.frame())
+        end = time.perf_counter()
+        stepping += middle - start
+        compositing += end - middle
+    reserved = embedSize(playbackEmbed(project), skip=(1, 2))
+    start = time.perf_counter()
+    for frame in frames:
+        screenFields(frame, reserved)
+    encoding = time.perf_counter() - start
+    start = time.perf_counter()
+    animate(project)
+    animating = time.perf_counter() - start
+    return {
+        "ticksPerSecond": ticks / stepping if stepping else 0.0,
+        "compositeMicroseconds": compositing / ticks * 1e6,
+        "encodeMicroseconds": encoding / ticks * 1e6,
+        "animateMilliseconds": animating * 1e3,
+        "clones": simulation.clones
+    }
+
+
+async def benchPlayback(project: Project) -> dict:
+    client = FakeClient()
+    ctx = client.context()
+    driver = TickDriver(interval=0)
+    runtime = Runtime(project, client, ctx, playbackEmbed(project))
+    await driver.play(runtime)
+    played = runtime.sentFrames + runtime.skippedFrames + runtime.coalescedFrames
+    return {
+        "editsSent": ctx.edits,
+        "framesSkipped": runtime.skippedFrames,
+        "bytesPerFrame": ctx.bytes / played if played else 0.0
+    }
+
+
+def calibrate() -> float:
+    """
+    Seconds a fixed workload takes that uses none of the bot's code: Python bytecode and small numpy operations,
+    the same mix the simulation runs.
+    """
+    start = time.perf_counter()
+    table = {}
+    total = 0
+    for i in range(100000):
+        table[i & 1023] = total
+        total += i * 3 % 7
+    buffer = np.zeros(27 * 14, dtype=np.uint8)
+    for i in range(5000):
+        buffer[i % 350:i % 350 + 25] = i & 7
+        buffer.tobytes()
+    return time.perf_counter() - start
+
+
+def normalize(metrics: dict, calibration: float) -> dict:
+    """
+    The timings of one run as if the machine had run :func:`calibrate` in ``REFERENCE_SECONDS``.
+    """
+    scale = REFERENCE_SECONDS / calibration
+    normalized = dict(metrics, calibrationSeconds=calibration)
+    for metric in TIMINGS & set(metrics):
+        normalized[metric] = metrics[metric] / scale if metric in HIGHER_IS_BETTER else metrics[metric] * scale
+    return normalized
+
+
+def best(runs: list) -> dict:
+    """
+    The best value of every metric over repeated runs, which is the least disturbed by whatever else the machine was doing.
+    """
+    return {metric: (max if metric in HIGHER_IS_BETTER else min)(run[metric] for run in runs) for metric in runs[0]}
+
+
+def run(ticks: int, repeat: int) -> dict:
+    results = {}
+    for name, make in scenarios.items():
+        runs = []
+        for _ in range(repeat):
+            # around the run, so the calibration sees the machine as busy as the run did
+            before = calibrate()
+            metrics = benchSimulation(make(), ticks)
+            runs.append(normalize(metrics, (before + calibrate()) / 2))
+        results[name] = best(runs)
+        results[name].update(asyncio.run(benchPlayback(make())))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a line for every metric that got worse than the baseline by more than ``tolerance``.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(scenario, {}).get(metric)
+            # how fast the machine was is not a result
+            if not old or metric == "calibrationSeconds":
+                continue
+            change = (value - old) / old
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{scenario}.{metric}: {old:.2f} -> {value:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the simulation and playback without Discord.")
+    parser.add_argument("--ticks", type=int, default=300, help="ticks simulated per scenario")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario, the best one counts")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    results = run(args.ticks, args.repeat)
+    for scenario, metrics in results.items():
+        print(scenario)
+        for metric, value in metrics.items():
+            print(f"    {metric:<24}{value:>14.2f}")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved to {args.baseline}")
+        return 0
+    if not os.path.isfile(args.baseline):
+        print("no baseline, run with --save to create one")
+        return 0
+    with open(args.baseline, "r") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print("regression:", line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
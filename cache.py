@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import typing
+import zlib
+
+import numpy as np
+
+from engine import Animation, Project
+
+# bump whenever the simulation would draw the same project differently, so older cached animations are never played
+ANIMATION_FORMAT = 1
+# magic, frame size, frame count, loop start (-1 if the animation doesn't loop)
+ANIMATION_HEADER = struct.Struct("<4sIIi")
+ANIMATION_MAGIC = b"DAN1"
+
+
+def sizeOf(obj, seen: set = None) -> int:
+    """
+    Rough number of bytes held by ``obj`` and everything it references.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(sizeOf(k, seen) + sizeOf(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(sizeOf(i, seen) for i in obj)
+    if hasattr(obj, "__dict__"):
+        return size + sizeOf(vars(obj), seen)
+    return size
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the estimated memory of its values. Safe to share between threads.
+    """
+    def __init__(self, maxBytes: int = 32 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size: int = None):
+        if size is None:
+            size = sizeOf(value)
+        with self.lock:
+            self.invalidate(key)
+            if size > self.maxBytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "maxBytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def animationKey(project: Project, ticks: int, maxClones: int, worldSize: list) -> str:
+    """
+    Hash of everything the frames of ``project`` depend on: the background color and, in order, the shape,
+    position and code of every sprite, plus the simulation limits. Names and IDs are left out,
+    so a copy of a project saved under another name or ID has the same key.
+    """
+    content = [
+        ANIMATION_FORMAT, ticks, maxClones, list(worldSize), project.backgroundColor,
+        [[sprite.shape, sprite.position, sprite.code.to_json()] for sprite in project.sprites]
+    ]
+    return hashlib.blake2b(json.dumps(content, separators=(",", ":")).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AnimationCache:
+    """
+    Simulated animations on disk, one zlib-compressed file per key of :func:`animationKey`, so playing a project
+    that was played before costs a file read instead of a simulation. Once the files take more than ``maxBytes``,
+    the least recently used ones are deleted; file modification times carry the order over restarts.
+
+    Several processes can share ``root``: a lookup always tries the file itself, but every process only evicts
+    the files it knows of, so each keeps its own bound. Safe to share between threads.
+    """
+    def __init__(self, root: str = "data/animations", maxBytes: int = 256 * 1024 * 1024):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        files = []
+        for entry in os.scandir(root):
+            if entry.name.endswith(".anim"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".anim")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.bytes += size
+        self.remove(self.evict())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".anim")
+
+    def get(self, key: str) -> typing.Optional[Animation]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            magic, frameSize, frameCount, loopStart = ANIMATION_HEADER.unpack_from(data)
+            frames = zlib.decompress(data[ANIMATION_HEADER.size:])
+            if magic != ANIMATION_MAGIC or len(frames) != frameSize * frameCount:
+                raise ValueError(f"{path} is not an animation")
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                self.forget(key)
+            return None
+        except (OSError, struct.error, zlib.error, ValueError):
+            logging.getLogger("disanimator").exception(f"dropping unreadable animation {path}")
+            with self.lock:
+                self.misses += 1
+                self.forget(key)
+            self.remove([key])
+            return None
+        with self.lock:
+            self.hits += 1
+            self.forget(key)
+            self.entries[key] = len(data)
+            self.bytes += len(data)
+        return Animation.fromBytes(frames, frameSize, None if loopStart < 0 else loopStart)
+
+    def put(self, key: str, animation: Animation):
+        if not animation.frames:
+            return
+        frameSize = len(animation.frames[0])
+        loopStart = -1 if animation.loopStart is None else animation.loopStart
+        data = ANIMATION_HEADER.pack(ANIMATION_MAGIC, frameSize, len(animation.frames), loopStart) + zlib.compress(animation.toBytes())
+        if len(data) > self.maxBytes:
+            return
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            logging.getLogger("disanimator").exception(f"failed to write animation {path}")
+            return
+        with self.lock:
+            self.forget(key)
+            self.entries[key] = len(data)
+            self.bytes += len(data)
+            evicted = self.evict()
+        self.remove(evicted)
+
+    def forget(self, key: str):
+        """
+        Drops ``key`` from the index, leaving its file alone. Must be called with the lock held.
+        """
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.bytes -= size
+
+    def evict(self) -> typing.List[str]:
+        """
+        Drops the least recently used keys from the index until it is within ``maxBytes``. Must be called with the lock held;
+        the files of the returned keys are then deleted with :meth:`remove`, outside of it.
+        """
+        evicted = []
+        while self.bytes > self.maxBytes:
+            key, size = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            evicted.append(key)
+        return evicted
+
+    def remove(self, keys: typing.List[str]):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "maxBytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
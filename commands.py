@@ -0,0 +1,122 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import typing
+
+logger = logging.getLogger("disanimator")
+
+
+def commandData(command) -> dict:
+    return command if isinstance(command, dict) else command.to_dict()
+
+
+def schemaOf(exported: dict) -> typing.Dict[str, list]:
+    """
+    The commands of ``InteractionClient.export_commands()`` as plain dicts by scope: ``"global"``, or ``"guild:{id}"``.
+    """
+    schema = {"global": [commandData(command) for command in exported["global"]]}
+    for guild, commands in exported["guild"].items():
+        schema[f"guild:{guild}"] = [commandData(command) for command in commands]
+    return schema
+
+
+def commandKey(command: dict) -> str:
+    # names are only unique per command type
+    return f"{command.get('type', 1)}:{command['name']}"
+
+
+def commandHash(command: dict) -> str:
+    return hashlib.blake2b(json.dumps(command, sort_keys=True, separators=(",", ":")).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def applicationOf(token: str) -> typing.Optional[str]:
+    """
+    ID of the application of a bot token, which is the base64 encoded first part of it. None if it doesn't look like one.
+    """
+    try:
+        id = base64.b64decode(token.split(".")[0] + "==", validate=True).decode("ascii")
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return id if id.isdecimal() else None
+
+
+class CommandRegistrar:
+    """
+    Registers slash commands only when they changed since the last start, and only the ones that did.
+
+    What was registered is kept in a manifest at ``path``: the hash and ID of every command by scope.
+    A command whose hash changed or that is new is created (which overwrites one of the same name),
+    one that is gone is deleted, and a scope the manifest doesn't know yet is overwritten in bulk.
+    Commands changed by anything else than this class go unnoticed; deleting the manifest registers everything again.
+
+    ``request(method, route, json=None)`` sends a request to the Discord API and returns the decoded response.
+    """
+    def __init__(self, request: typing.Callable[..., typing.Awaitable], path: str = "data/commands.json"):
+        self.request = request
+        self.path = path
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"ignoring the unreadable command manifest {self.path}")
+            return {}
+
+    def save(self, manifest: dict):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temporary, self.path)
+
+    def route(self, application: str, scope: str) -> str:
+        if scope == "global":
+            return f"/applications/{application}/commands"
+        return f"/applications/{application}/guilds/{scope[len('guild:'):]}/commands"
+
+    async def sync(self, application: str, schema: typing.Dict[str, list]) -> int:
+        """
+        Brings the registered commands of ``application`` in line with ``schema`` (see :func:`schemaOf`).
+        Returns the number of requests it took, 0 if nothing changed.
+        """
+        manifest = self.load()
+        if manifest.get("application") != application:
+            manifest = {"application": application, "scopes": {}}
+        scopes = manifest["scopes"]
+        requests = 0
+        try:
+            # a scope that is not in the schema any more still has its commands removed
+            for scope in sorted(set(schema) | set(scopes)):
+                commands = {commandKey(command): command for command in schema.get(scope, [])}
+                route = self.route(application, scope)
+                if scope not in scopes:
+                    registered = await self.request("PUT", route, json=list(commands.values()))
+                    requests += 1
+                    scopes[scope] = {
+                        commandKey(command): {"hash": commandHash(commands[commandKey(command)]), "id": command["id"]}
+                        for command in registered
+                    }
+                    continue
+                known = scopes[scope]
+                for key, command in commands.items():
+                    hash = commandHash(command)
+                    if key in known and known[key]["hash"] == hash:
+                        continue
+                    registered = await self.request("POST", route, json=command)
+                    requests += 1
+                    known[key] = {"hash": hash, "id": registered["id"]}
+                for key in [key for key in known if key not in commands]:
+                    await self.request("DELETE", f"{route}/{known[key]['id']}")
+                    requests += 1
+                    del known[key]
+                if not known and scope not in schema:
+                    del scopes[scope]
+        finally:
+            if requests:
+                self.save(manifest)
+        return requests
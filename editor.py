@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import time
+import typing
+
+import dico
+from dico_interaction import InteractionContext
+
+from stats import editTime, stats
+from storage import AsyncStorage
+
+# how long after a component interaction it can still be answered directly, a bit under Discord's 3 seconds
+RESPONSE_WINDOW = 2.5
+# custom IDs of editor components start with this, so the components of anything else never reach an editor
+COMPONENT_PREFIX = "editor_"
+
+
+class Session:
+    """
+    Inbox of an editor resident in memory: the clicks of its author on its components, in the order they came in.
+    Clicks that come in while the editor is busy wait here, unless they waited too long to still be answered.
+    """
+    def __init__(self, author: int):
+        self.author = author
+        self.queue = asyncio.Queue()
+        self.received = 0.0
+
+    def deliver(self, ictx: InteractionContext):
+        if int(ictx.author.id) == self.author:
+            self.queue.put_nowait((time.monotonic(), ictx))
+
+    async def next(self, timeout: float = None) -> InteractionContext:
+        """
+        The next click that can still be answered. ``received`` is set to when it came in.
+        Raises :class:`asyncio.TimeoutError` if there is none within ``timeout`` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            received, ictx = await asyncio.wait_for(self.queue.get(), None if deadline is None else max(deadline - loop.time(), 0))
+            if time.monotonic() - received < RESPONSE_WINDOW:
+                self.received = received
+                return ictx
+
+
+# editors resident in memory by ID, which is the ID of the interaction that opened them
+sessions: typing.Dict[int, Session] = {}
+# futures waiting for a chat message with their checks, by (channel, author)
+replies: typing.Dict[typing.Tuple[int, int], list] = {}
+
+
+def session(coro):
+    """
+    Marks an editor command as an open session for as long as it runs.
+    """
+    @functools.wraps(coro)
+    async def wrapper(ctx: InteractionContext, *args, **kwargs):
+        inbox = sessions[int(ctx.id)] = Session(int(ctx.author.id))
+        try:
+            return await coro(ctx, *args, **kwargs)
+        finally:
+            # a hibernated editor can already be restored under the same ID
+            if sessions.get(int(ctx.id)) is inbox:
+                del sessions[int(ctx.id)]
+    return wrapper
+
+
+async def waitReply(channel: int, author: int, check: typing.Callable[[dico.Message], bool] = None, timeout: float = None) -> dico.Message:
+    """
+    The next message of ``author`` in ``channel`` that passes ``check``.
+    Only the waits for the same channel and author see a message, so a message costs the same however many editors wait.
+    """
+    key = (int(channel), int(author))
+    waiter = (check, asyncio.get_running_loop().create_future())
+    replies.setdefault(key, []).append(waiter)
+    try:
+        return await asyncio.wait_for(waiter[1], timeout)
+    finally:
+        waiters = replies[key]
+        waiters.remove(waiter)
+        if not waiters:
+            del replies[key]
+
+
+def receiveMessage(message: dico.Message):
+    """
+    Listener of every message: hands it to the first wait of its channel and author it passes the check of.
+    """
+    if message.author is None:
+        return
+    for check, future in replies.get((int(message.channel_id), int(message.author.id)), ()):
+        if not future.done() and (check is None or check(message)):
+            future.set_result(message)
+            return
+
+
+class EditorView:
+    """
+    What an editor message currently shows, so that an update only sends the parts that changed.
+
+    ``embed`` is edited in place by the editor; ``components`` builds the component rows from the editor's state.
+    An update answers the interaction that triggered it with ``update_message=True`` when that is still possible,
+    and falls back to editing the original response otherwise (after a prompt was answered, for example).
+    """
+    def __init__(self, ctx: InteractionContext, embed: dico.Embed, components: typing.Callable[[], list]):
+        self.ctx = ctx
+        self.embed = embed
+        self.components = components
+        self.sentFields = None
+        self.sentComponents = None
+        self.ictx = None
+        self.received = 0.0
+        self.sentUpdates = 0
+        self.skippedUpdates = 0
+
+    def sent(self, embed: bool = True, components: bool = True):
+        """
+        Marks the current state as shown, for messages sent outside of :meth:`update`.
+        """
+        if embed:
+            self.sentFields = fieldsOf(self.embed)
+        if components:
+            self.sentComponents = [row.to_dict() for row in self.components()]
+
+    def receive(self, ictx: InteractionContext, received: float = None):
+        self.ictx = ictx
+        self.received = time.monotonic() if received is None else received
+
+    @property
+    def canRespond(self) -> bool:
+        return self.ictx is not None and not self.ictx.deferred and time.monotonic() - self.received < RESPONSE_WINDOW
+
+    async def update(self) -> bool:
+        """
+        Sends whatever changed since the last update. Returns ``False`` if nothing did.
+        """
+        fields = fieldsOf(self.embed)
+        rows = self.components()
+        components = [row.to_dict() for row in rows]
+        changes = {}
+        if fields != self.sentFields:
+            changes["embed"] = self.embed
+        if components != self.sentComponents:
+            changes["components"] = rows
+        if not changes:
+            self.skippedUpdates += 1
+            if self.canRespond:
+                # the interaction still has to be acknowledged, but the message is left alone
+                await self.ictx.defer(update_message=True)
+            return False
+        with stats.time(editTime):
+            if self.canRespond:
+                await self.ictx.send(update_message=True, **changes)
+            else:
+                await self.ctx.edit_original_response(**changes)
+        self.sentFields = fields
+        self.sentComponents = components
+        self.sentUpdates += 1
+        return True
+
+
+class Hibernator:
+    """
+    Saves editors that were left idle to storage and ends them, so that an editor nobody uses holds no memory.
+    A later click on the editor's message takes the saved state back and resumes the editor
+    through the coroutine registered with :meth:`restorer` for its kind, as ``restorer(ictx, id, state)``.
+    Editors are hibernated only while they wait for a component; the state has to be JSON serializable.
+    """
+    def __init__(self, storage: AsyncStorage, idleSeconds: float = 60.0, keepSeconds: float = 7 * 24 * 60 * 60):
+        self.storage = storage
+        self.idleSeconds = idleSeconds
+        self.keepSeconds = keepSeconds
+        self.restorers = {}
+        # (author, write) in progress by editor id, so a click of the author that comes in meanwhile waits for it
+        self.saving = {}
+        self.count = 0
+
+    def restorer(self, kind: str):
+        def decorator(coro):
+            self.restorers[kind] = coro
+            return coro
+        return decorator
+
+    async def hibernate(self, id: int, kind: str, author: int, state: dict):
+        """
+        Saves the state of the editor ``id``, which should return right after.
+        The editor stops taking clicks right away: one that comes in during the save restores it once it is saved.
+        """
+        sessions.pop(id, None)
+        saving = asyncio.ensure_future(self.storage.saveSession(id, kind, author, state, self.keepSeconds))
+        self.saving[id] = (author, saving)
+        try:
+            self.count = await saving
+        finally:
+            del self.saving[id]
+
+    async def receive(self, ictx: InteractionContext):
+        """
+        Listener of every interaction: hands a click on an editor's component to the editor if it is resident,
+        and resumes it if it is hibernated.
+        """
+        if not ictx.type.message_component:
+            return
+        id = sessionOf(ictx.data.custom_id)
+        if id is None:
+            return
+        if id in sessions:
+            sessions[id].deliver(ictx)
+            return
+        author = int(ictx.author.id)
+        if id in self.saving:
+            owner, saving = self.saving[id]
+            if owner != author:
+                return
+            await asyncio.wait([saving])
+            found = True
+        else:
+            # checked without taking the write lock, most clicks here are on editors of someone else or long gone ones
+            found = await self.storage.hasSession(id, author)
+        if id in sessions:
+            # another click got here first and is restoring it
+            sessions[id].deliver(ictx)
+            return
+        if not found:
+            return
+        # taken before the next await, so a second click can't restore the same editor twice
+        inbox = sessions[id] = Session(author)
+        try:
+            saved = await self.storage.takeSession(id, author)
+            if saved is None:
+                return
+            self.count = max(self.count - 1, 0)
+            kind, state = saved
+            await self.restorers[kind](ictx, id, state)
+        finally:
+            if sessions.get(id) is inbox:
+                del sessions[id]
+
+
+def componentID(name: str, id: int) -> str:
+    """
+    Custom ID of the component ``name`` of the editor ``id``, which :func:`sessionOf` takes apart again.
+    """
+    return f"{COMPONENT_PREFIX}{name}_{id}"
+
+
+def sessionOf(customID: str) -> typing.Optional[int]:
+    """
+    ID of the editor a component belongs to, None if it is not one made with :func:`componentID`.
+    """
+    if not customID.startswith(COMPONENT_PREFIX):
+        return None
+    name, _, id = customID[len(COMPONENT_PREFIX):].rpartition("_")
+    return int(id) if name and id.isdecimal() else None
+
+
+def fieldsOf(embed: dico.Embed) -> list:
+    return [(field.name, field.value) for field in embed.fields]
@@ -0,0 +1,47 @@
+from engine import SCREEN_WIDTH, compactRowEncoder, rowEncoder, textSize
+
+# Discord embed limits, counted with textSize
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+EMBED_LIMIT = 6000
+
+
+def embedSize(embed, skip: tuple = ()):
+    """
+    Size of ``embed`` counted against ``EMBED_LIMIT``, leaving out the fields at the indexes in ``skip``.
+    """
+    size = textSize(embed.title or "") + textSize(embed.description or "")
+    if embed.footer:
+        size += textSize(embed.footer.text or "")
+    if embed.author:
+        size += textSize(embed.author.name or "")
+    for i, field in enumerate(embed.fields):
+        if i not in skip:
+            size += textSize(field.name) + textSize(field.value)
+    return size
+
+
+def screenFields(frame: bytes, reserved: int = 0, width: int = SCREEN_WIDTH):
+    """
+    Lays a frame out as the two screen fields, ``[(name, value), (name, value)]``,
+    where the first row of each half is the field name.
+    Returns the fields and their total size. If the regular glyphs would go over a field limit
+    or over what is left of the embed after ``reserved``, the compact glyphs are used instead.
+    """
+    for encoder in (rowEncoder, compactRowEncoder):
+        rows = encoder.encodeFrame(frame, width)
+        half = len(rows) // 2
+        fields = []
+        total = 0
+        fits = True
+        for part in (rows[:half], rows[half:]):
+            name, nameSize = part[0]
+            value = "\n".join([text for text, size in part[1:]])
+            valueSize = sum([size for text, size in part[1:]]) + len(part) - 2
+            if nameSize > FIELD_NAME_LIMIT or valueSize > FIELD_VALUE_LIMIT:
+                fits = False
+            fields.append((name, value))
+            total += nameSize + valueSize
+        if fits and reserved + total <= EMBED_LIMIT:
+            break
+    return fields, total
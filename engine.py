@@ -0,0 +1,1090 @@
+import bisect
+import itertools
+import time
+import typing
+from array import array
+
+import numpy as np
+
+MAX_TICKS = 100
+MAX_CLONES = 1000
+# the screen shows a SCREEN_HEIGHT x SCREEN_WIDTH part of a WORLD_HEIGHT x WORLD_WIDTH world, starting at the camera
+SCREEN_HEIGHT = 14
+SCREEN_WIDTH = 27
+WORLD_HEIGHT = 56
+WORLD_WIDTH = 108
+
+colors = {
+    "blank": "<:blank:924156268317392926>",
+    "red": "🟥",
+    "orange": "🟧",
+    "yellow": "🟨",
+    "green": "🟩",
+    "blue": "🟦",
+    "purple": "🟪",
+    "brown": "🟫",
+    "black": "⬛",
+    "white": "⬜"
+}
+
+# palette index of each color; index 0 ("blank") is transparent
+palette = list(colors)
+paletteIndex = {color: i for i, color in enumerate(palette)}
+paletteEmoji = [colors[color] for color in palette]
+# shorter glyphs for when the custom blank emoji makes a message too long
+compactEmoji = [colors[color] if color != "blank" else "▫️" for color in palette]
+
+
+def textSize(text: str):
+    """
+    Length of ``text`` as Discord counts it against its limits (UTF-16 code units).
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+
+class RowEncoder:
+    """
+    Memoizes the emoji string of every distinct row, keyed by its palette indices as bytes.
+    The cache is shared by every tick and session that uses the same glyphs.
+    """
+    def __init__(self, emoji: list[str], maxRows: int = 65536):
+        self.emoji = emoji
+        self.maxRows = maxRows
+        self.rows = {}
+
+    def encode(self, row: bytes):
+        """
+        Returns ``(text, size)`` of the row.
+        """
+        encoded = self.rows.get(row)
+        if encoded is None:
+            if len(self.rows) >= self.maxRows:
+                self.rows.clear()
+            text = ''.join([self.emoji[c] for c in row])
+            encoded = self.rows[row] = (text, textSize(text))
+        return encoded
+
+    def encodeColors(self, row: list[str]):
+        return self.encode(bytes([paletteIndex[c] for c in row]))[0]
+
+    def encodeFrame(self, frame: bytes, width: int = SCREEN_WIDTH):
+        return [self.encode(frame[i:i + width]) for i in range(0, len(frame), width)]
+
+
+rowEncoder = RowEncoder(paletteEmoji)
+compactRowEncoder = RowEncoder(compactEmoji)
+
+# opcodes of a compiled sprite program
+OP_END = 0
+OP_MOVE = 1
+OP_MOVETO = 2
+OP_TURN = 3
+OP_SHOW = 4
+OP_HIDE = 5
+OP_WAIT = 6
+OP_DUPLICATE = 7
+# ends whenUpdated: the list starts over on the next tick
+OP_LOOP = 8
+OP_CAMERA = 9
+
+# target of the touch event lists that run when a sprite touches the edge of the world rather than another sprite
+TOUCH_EDGE = -1
+# a sprite can listen for touching this many things at most, one bit each in EntityStore.touching
+MAX_TOUCHES = 64
+
+# (dx, dy) of the directions used by "move" (0: right, 1: down, 2: left, 3: up)
+directions = {
+    0: (1, 0),
+    1: (0, 1),
+    2: (-1, 0),
+    3: (0, -1)
+}
+
+
+class CodeError(ValueError):
+    pass
+
+
+class SimulationCancelled(Exception):
+    pass
+
+
+# how "turn" rearranges a 5x5 shape (1: along the main diagonal, 2: mirrored, 3: along the other diagonal)
+turns = {
+    1: lambda a: a.T,
+    2: lambda a: a[:, ::-1],
+    3: lambda a: a[::-1, ::-1].T
+}
+
+
+def buildOrientations():
+    """
+    Finds every orientation reachable with ``turns`` (all eight symmetries of the square).
+    Returns each orientation as a flat index into the original shape,
+    and ``turnTable[orientation][direction]`` giving the orientation after a turn.
+    """
+    grid = np.arange(25).reshape(5, 5)
+    orientations = [grid]
+    found = {grid.tobytes(): 0}
+    turnTable = []
+    for orientation in orientations:
+        row = [len(turnTable)]
+        for direction in (1, 2, 3):
+            turned = np.ascontiguousarray(turns[direction](orientation))
+            if turned.tobytes() not in found:
+                found[turned.tobytes()] = len(orientations)
+                orientations.append(turned)
+            row.append(found[turned.tobytes()])
+        turnTable.append(row)
+    return [orientation.ravel() for orientation in orientations], turnTable
+
+
+orientations, turnTable = buildOrientations()
+
+
+class SpriteAtlas:
+    """
+    Every orientation of a sprite shape, computed once when the sprite is loaded.
+    Each orientation is kept cropped to its bounding box along with its opaque mask,
+    so runtime sprites only need to hold an orientation index.
+    """
+    def __init__(self, shape: list):
+        base = np.array([[paletteIndex[c] for c in row] for row in shape], dtype=np.uint8).ravel()
+        self.indices = []
+        self.masks = []
+        self.boxes = []
+        # the opaque cells of the whole 5x5 shape as 25 bits, cell (row, column) at bit row * 5 + column
+        self.bits = []
+        for orientation in orientations:
+            indices = base[orientation].reshape(5, 5)
+            mask = indices != 0
+            self.bits.append(sum(1 << int(i) for i in np.flatnonzero(mask)))
+            rows, columns = np.nonzero(mask)
+            if len(rows) == 0:
+                self.indices.append(None)
+                self.masks.append(None)
+                self.boxes.append(None)
+                continue
+            x0, y0, x1, y1 = int(columns.min()), int(rows.min()), int(columns.max()) + 1, int(rows.max()) + 1
+            self.indices.append(indices[y0:y1, x0:x1].copy())
+            self.masks.append(mask[y0:y1, x0:x1].copy())
+            self.boxes.append((x0, y0, x1, y1))
+
+    def draw(self, compositor: "Compositor", orientation: int, x: int, y: int):
+        box = self.boxes[orientation]
+        if box is not None:
+            compositor.draw(self.indices[orientation], self.masks[orientation], x + box[0], y + box[1])
+
+
+class Sprite:
+    def __init__(self, name: str, size: list):
+        self.name = name
+        self.size = size
+        self.shape = [['blank' for j in range(5)] for i in range(5)]
+        self.atlas = None
+
+    def render(self, rowIndex: int = None, columnIndex: int = None):
+        if rowIndex is None and columnIndex is None:
+            return '\n'.join([rowEncoder.encodeColors(row) for row in self.shape])
+        elif columnIndex is None:
+            return rowEncoder.encodeColors(self.shape[rowIndex])
+        elif rowIndex is None:
+            return '\n'.join(colors[c] for c in [row[columnIndex] for row in self.shape])
+        else:
+            return colors[self.shape[rowIndex][columnIndex]]
+
+    def getAtlas(self):
+        if self.atlas is None:
+            self.atlas = SpriteAtlas(self.shape)
+        return self.atlas
+
+    @staticmethod
+    def from_json(json_data: dict):
+        sprite = Sprite(json_data["name"], [5, 5])
+        sprite.shape = [list(row) for row in json_data["shape"]]
+        sprite.getAtlas()
+        return sprite
+
+
+class Codes:
+    """
+    The event lists of a sprite. ``whenTouching`` holds ``[target, codes]`` pairs,
+    where ``target`` is the index in the project of the sprite whose touch (or whose clones' touch) runs ``codes``.
+    """
+    def __init__(self, whenStarted = None, whenUpdated = None, whenDuplicated = None, whenTouchingEdge = None, whenTouching = None):
+        if whenUpdated is None:
+            whenUpdated = []
+        if whenDuplicated is None:
+            whenDuplicated = []
+        if whenStarted is None:
+            whenStarted = []
+        if whenTouchingEdge is None:
+            whenTouchingEdge = []
+        if whenTouching is None:
+            whenTouching = []
+        self.whenStarted = whenStarted
+        self.whenUpdated = whenUpdated
+        self.whenDuplicated = whenDuplicated
+        self.whenTouchingEdge = whenTouchingEdge
+        self.whenTouching = whenTouching
+
+    def touching(self, target: int) -> list:
+        """
+        The list run when touching the sprite ``target``, added if there was none.
+        """
+        for touched, codes in self.whenTouching:
+            if touched == target:
+                return codes
+        self.whenTouching.append([target, []])
+        return self.whenTouching[-1][1]
+
+    def getAsString(self, target: int = None):
+        """
+        The lists as text: whenStarted, whenUpdated, whenDuplicated, whenTouchingEdge, then the list run when touching ``target``.
+        """
+        a = []
+        touching = next((codes for touched, codes in self.whenTouching if touched == target), [])
+        for j in [self.whenStarted, self.whenUpdated, self.whenDuplicated, self.whenTouchingEdge, touching]:
+            toAdd = []
+            for num, i in enumerate(j):
+                if i[0] == "move":
+                    if i[1] == 0:
+                        toAdd.append(f"오른쪽으로 {i[2]}칸 이동하기")
+                    elif i[1] == 1:
+                        toAdd.append(f"아래로 {i[2]}칸 이동하기")
+                    elif i[1] == 2:
+                        toAdd.append(f"왼쪽으로 {i[2]}칸 이동하기")
+                    elif i[1] == 3:
+                        toAdd.append(f"위로 {i[2]}칸 이동하기")
+                elif i[0] == "moveTo":
+                    toAdd.append(f"세로: {i[1][0]}, 가로: {i[1][1]}(으)로 이동하기")
+                elif i[0] == "turn":
+                    if i[1] == 0:
+                        toAdd.append(f"오른쪽으로 90도 회전하기")
+                    elif i[1] == 1:
+                        toAdd.append(f"왼쪽으로 90도 회전하기")
+                elif i[0] == "display":
+                    if i[1] == True:
+                        toAdd.append(f"숨기기")
+                    else:
+                        toAdd.append(f"보이기")
+                elif i[0] == "wait":
+                    toAdd.append(f"{i[1]}틱 기다리기")
+                elif i[0] == "duplicate":
+                    toAdd.append(f"{i[1][1]}, {i[1][0]} 칸에 자신 복제하기")
+                elif i[0] == "camera":
+                    toAdd.append(f"세로: {i[1][0]}, 가로: {i[1][1]}(으)로 카메라 옮기기")
+                toAdd[-1] = f"{num+1}. {toAdd[-1]}"
+            a.append("\n".join(toAdd))
+        return a
+
+
+    def setSprite(self, sprite: "SpriteInProject"):
+        self.sprite = sprite
+
+
+    @staticmethod
+    def move(direction: int, distance: int):
+        return ["move", direction, distance]
+
+    @staticmethod
+    def turn(direction: int):
+        return ["turn", direction]
+
+    @staticmethod
+    def display(transparent: bool):
+        return ["display", transparent]
+
+    @staticmethod
+    def wait(duration: int):
+        return ["wait", duration]
+
+    @staticmethod
+    def moveTo(location: list):
+        return ["moveTo", location]
+
+    @staticmethod
+    def duplicate(location: list):
+        return ["duplicate", location]
+
+    @staticmethod
+    def camera(location: list):
+        return ["camera", location]
+
+    @staticmethod
+    def from_json(json_data: list):
+        # projects saved before the touch events have only the first three lists
+        return Codes(
+            whenStarted=json_data[0], whenUpdated=json_data[1], whenDuplicated=json_data[2],
+            whenTouchingEdge=json_data[3] if len(json_data) > 3 else None, whenTouching=json_data[4] if len(json_data) > 4 else None
+        )
+
+    def to_json(self):
+        return [self.whenStarted, self.whenUpdated, self.whenDuplicated, self.whenTouchingEdge, self.whenTouching]
+
+    def compile(self) -> "Program":
+        return Program.compile(self)
+
+
+class Program:
+    """
+    Flat opcode form of :class:`Codes`, built once per play.
+    The event lists are laid out one after another, each terminated by ``OP_END``
+    (or ``OP_LOOP`` for a non-empty whenUpdated); ``entries`` holds the index of the first instruction of each list.
+    ``touches`` holds ``(target, entry)`` for every non-empty touch list, the edge being ``TOUCH_EDGE``.
+    """
+    def __init__(self):
+        self.ops = array('B')
+        self.argA = array('i')
+        self.argB = array('i')
+        self.entries = [0, 0, 0]
+        self.touches = []
+        self.maxWait = 0
+
+    @property
+    def whenStarted(self):
+        return self.entries[0]
+
+    @property
+    def whenUpdated(self):
+        return self.entries[1]
+
+    @property
+    def whenDuplicated(self):
+        return self.entries[2]
+
+    def emit(self, op: int, a: int = 0, b: int = 0):
+        self.ops.append(op)
+        self.argA.append(a)
+        self.argB.append(b)
+
+    def isEmpty(self, entry: int):
+        return self.ops[entry] == OP_END
+
+    @staticmethod
+    def compile(codes: Codes) -> "Program":
+        program = Program()
+        for index, (event, isCopy) in enumerate([(codes.whenStarted, False), (codes.whenUpdated, False), (codes.whenDuplicated, True)]):
+            program.entries[index] = program.emitList(event, isCopy)
+            if index == 1 and len(program.ops) > program.entries[index]:
+                program.emit(OP_LOOP, program.entries[index])
+            else:
+                program.emit(OP_END)
+        try:
+            touches = [(TOUCH_EDGE, codes.whenTouchingEdge)] + [(int(target), event) for target, event in codes.whenTouching]
+        except (TypeError, ValueError):
+            raise CodeError(f"닿았을 때 코드를 해석할 수 없습니다: {codes.whenTouching!r}") from None
+        for target, event in touches:
+            if event:
+                program.touches.append((target, program.emitList(event, False)))
+                program.emit(OP_END)
+        if len(program.touches) > MAX_TOUCHES:
+            raise CodeError(f"닿았을 때 코드는 {MAX_TOUCHES}개까지만 만들 수 있습니다.")
+        return program
+
+    def emitList(self, event: list, isCopy: bool) -> int:
+        """
+        Emits the instructions of an event list, without its terminator. Returns where they start.
+        """
+        entry = len(self.ops)
+        for num, code in enumerate(event):
+            try:
+                self.emitCode(code, isCopy)
+            except (TypeError, ValueError, IndexError, KeyError):
+                raise CodeError(f"{num + 1}번째 코드를 해석할 수 없습니다: {code!r}") from None
+        return entry
+
+    def emitCode(self, code: list, isCopy: bool):
+        if code[0] == "move":
+            dx, dy = directions[code[1]]
+            distance = int(code[2])
+            self.emit(OP_MOVE, dx * distance, dy * distance)
+        elif code[0] == "turn":
+            direction = int(code[1])
+            if direction not in (0, 1, 2, 3):
+                raise ValueError(direction)
+            if direction:
+                self.emit(OP_TURN, direction)
+        elif code[0] == "display":
+            # display(True) hides the sprite
+            self.emit(OP_HIDE if code[1] else OP_SHOW)
+        elif code[0] == "wait":
+            duration = int(code[1])
+            if duration < 0:
+                raise ValueError(duration)
+            # a wait always lasts at least until the next tick
+            duration = max(duration, 1)
+            self.maxWait = max(self.maxWait, duration)
+            self.emit(OP_WAIT, duration)
+        elif code[0] == "moveTo":
+            # locations are entered as [row, column]
+            self.emit(OP_MOVETO, int(code[1][1]), int(code[1][0]))
+        elif code[0] == "duplicate":
+            # clones can't duplicate themselves
+            if not isCopy:
+                self.emit(OP_DUPLICATE, int(code[1][1]), int(code[1][0]))
+        elif code[0] == "camera":
+            # the top left corner of the screen, as [row, column] of the world
+            self.emit(OP_CAMERA, int(code[1][1]), int(code[1][0]))
+        else:
+            raise ValueError(code[0])
+
+
+class SpriteInProject(Sprite):
+    def __init__(self, sprite: Sprite, position: list, id: int, code: Codes = None):
+        super().__init__(sprite.name, sprite.size)
+        self.id = id
+        self.shape = sprite.shape
+        self.atlas = sprite.getAtlas()
+        self.position = position
+        if code is None:
+            self.code = Codes()
+        else:
+            self.code = code
+
+
+class Compositor:
+    """
+    Palette index framebuffer. It is reused across ticks: ``clear`` and ``draw`` the sprites in order,
+    later sprites are drawn over earlier ones and blank cells are left untouched.
+    """
+    def __init__(self, backgroundColor: str, height: int = SCREEN_HEIGHT, width: int = SCREEN_WIDTH):
+        self.background = paletteIndex[backgroundColor]
+        self.height = height
+        self.width = width
+        self.frame = np.full((height, width), self.background, dtype=np.uint8)
+
+    def clear(self):
+        self.frame.fill(self.background)
+
+    def draw(self, indices: np.ndarray, mask: np.ndarray, x: int, y: int):
+        height, width = indices.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        np.copyto(self.frame[y0:y1, x0:x1], indices[y0 - y:y1 - y, x0 - x:x1 - x], where=mask[y0 - y:y1 - y, x0 - x:x1 - x])
+
+    def rows(self):
+        return frameRows(self.frame.tobytes(), self.width)
+
+    def render(self):
+        return '\n'.join(self.rows())
+
+
+class Project:
+    def __init__(self, name: str, backgroundColor: str, sprites: list[SpriteInProject]):
+        self.name = name
+        self.backgroundColor = backgroundColor
+        self.sprites = sprites
+        self.display = Compositor(backgroundColor)
+
+    def redraw(self):
+        self.display.clear()
+        for sprite in self.sprites:
+            sprite.atlas.draw(self.display, 0, sprite.position[0], sprite.position[1])
+
+    def frame(self) -> bytes:
+        return self.display.frame.tobytes()
+
+    def render(self):
+        return self.display.render()
+
+    def validate(self):
+        """
+        Compiles the code of every sprite, raising :class:`CodeError` if any of it is invalid.
+        """
+        self.compile()
+
+    def compile(self) -> typing.List[Program]:
+        """
+        The program of every sprite. Raises :class:`CodeError` if any code is invalid or listens for touching a missing sprite.
+        """
+        programs = [sprite.code.compile() for sprite in self.sprites]
+        for program in programs:
+            for target, entry in program.touches:
+                if target != TOUCH_EDGE and not 0 <= target < len(programs):
+                    raise CodeError(f"{target + 1}번째 스프라이트가 없어서 닿았을 때 코드를 실행할 수 없습니다.")
+        return programs
+
+    def to_json(self):
+        """
+        Self-contained form of the project, with the sprite shapes inlined. Used to hand projects to other processes.
+        """
+        return {
+            "name": self.name,
+            "backgroundColor": self.backgroundColor,
+            "sprites": [
+                {"id": sprite.id, "name": sprite.name, "shape": sprite.shape, "position": sprite.position, "code": sprite.code.to_json()}
+                for sprite in self.sprites
+            ]
+        }
+
+    @staticmethod
+    def from_json(json_data: dict):
+        return Project(name=json_data["name"], backgroundColor=json_data["backgroundColor"], sprites=[
+            SpriteInProject(Sprite.from_json(sprite), position=list(sprite["position"]), id=sprite["id"], code=Codes.from_json(sprite["code"]))
+            for sprite in json_data["sprites"]
+        ])
+
+
+class TimingWheel:
+    """
+    Continuations ``(slot, pc)`` waiting to run, bucketed by the tick they are due.
+    ``size`` must be at least the longest delay, so every continuation in a popped slot is due.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.slots = [[] for i in range(size)]
+
+    def schedule(self, tick: int, slot: int, pc: int):
+        self.slots[tick % self.size].append((slot, pc))
+
+    def pending(self, tick: int):
+        """
+        Yields ``(delay, slot, pc)`` for everything scheduled after ``tick``, in the order it will run.
+        """
+        for delay in range(1, self.size + 1):
+            for slot, pc in self.slots[(tick + delay) % self.size]:
+                yield delay, slot, pc
+
+    def pop(self, tick: int):
+        index = tick % self.size
+        slot = self.slots[index]
+        if slot:
+            self.slots[index] = []
+        return slot
+
+
+class EntityStore:
+    """
+    State of every sprite and clone of a running simulation, one array per field,
+    so that an entity is a slot index rather than an object and a thousand clones take a few kilobytes.
+    ``program`` is the index of the project sprite an entity runs the code of (and is drawn as).
+    ``touching`` has a bit set for every touch list of the program whose target the entity touched at the last check.
+    Released slots are zeroed and put on a free list for the next clone.
+    """
+    def __init__(self):
+        self.x = array('q')
+        self.y = array('q')
+        self.orientation = array('B')
+        self.visible = array('B')
+        self.program = array('H')
+        self.touching = array('Q')
+        self.free = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def spawn(self, program: int, x: int, y: int, orientation: int = 0, visible: bool = True) -> int:
+        if self.free:
+            slot = self.free.pop()
+            self.x[slot] = x
+            self.y[slot] = y
+            self.orientation[slot] = orientation
+            self.visible[slot] = visible
+            self.program[slot] = program
+            return slot
+        self.x.append(x)
+        self.y.append(y)
+        self.orientation.append(orientation)
+        self.visible.append(visible)
+        self.program.append(program)
+        self.touching.append(0)
+        return len(self.x) - 1
+
+    def release(self, slot: int):
+        self.x[slot] = self.y[slot] = 0
+        self.orientation[slot] = self.visible[slot] = self.program[slot] = self.touching[slot] = 0
+        self.free.append(slot)
+
+    def state(self):
+        # the free list decides which slots the next clones get, so it is part of the state too
+        return (
+            self.x.tobytes(), self.y.tobytes(), self.orientation.tobytes(), self.visible.tobytes(), self.program.tobytes(),
+            self.touching.tobytes(), tuple(self.free)
+        )
+
+
+class SpatialHash:
+    """
+    Slots of the entities by the ``cellSize`` x ``cellSize`` cell of the world their position is in,
+    so that the entities around the screen are found without looking at every other one.
+    """
+    def __init__(self, cellSize: int = 8):
+        self.cellSize = cellSize
+        self.cells = {}
+        self.cellOf = {}
+        # most slots each set held since it was built: sets keep their table when emptied, which slows iterating them
+        self.largest = {}
+
+    def insert(self, slot: int, x: int, y: int):
+        cell = (x // self.cellSize, y // self.cellSize)
+        self.cellOf[slot] = cell
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            bucket = self.cells[cell] = set()
+        bucket.add(slot)
+        if len(bucket) > self.largest.get(cell, 0):
+            self.largest[cell] = len(bucket)
+
+    def remove(self, slot: int):
+        cell = self.cellOf.pop(slot, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            bucket.discard(slot)
+            if not bucket:
+                del self.cells[cell]
+                del self.largest[cell]
+            elif len(bucket) * 4 < self.largest[cell]:
+                self.cells[cell] = set(bucket)
+                self.largest[cell] = len(bucket)
+
+    def move(self, slot: int, x: int, y: int):
+        """
+        Moves ``slot`` to the cell of ``(x, y)``. Slots that were removed stay out.
+        """
+        old = self.cellOf.get(slot)
+        if old is not None and old != (x // self.cellSize, y // self.cellSize):
+            self.remove(slot)
+            self.insert(slot, x, y)
+
+    def query(self, x0: int, y0: int, x1: int, y1: int) -> typing.List[typing.Set[int]]:
+        """
+        Sets of slots of the cells overlapping ``[x0, x1) x [y0, y1)``: every entity positioned there, and some around it.
+        """
+        size = self.cellSize
+        found = []
+        for cy in range(y0 // size, (y1 - 1) // size + 1):
+            for cx in range(x0 // size, (x1 - 1) // size + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    found.append(bucket)
+        return found
+
+
+class PlacementGrid:
+    """
+    Broad phase of the touch events: entities counted by where they are placed, ``(x, y, orientation)``,
+    per sprite and cell of a uniform grid. Entities stacked at the same place are looked at once,
+    so a pile of clones costs a touch check no more than a single clone. Hidden entities touch nothing and are left out.
+    """
+    def __init__(self, cellSize: int = 8):
+        self.cellSize = cellSize
+        self.cells = {}
+        # (cell, place) of every slot in the grid, None while it is hidden
+        self.placeOf = {}
+
+    def place(self, slot: int, program: int, x: int, y: int, orientation: int, visible: bool = True):
+        self.remove(slot)
+        if not visible:
+            self.placeOf[slot] = None
+            return
+        cell = (program, x // self.cellSize, y // self.cellSize)
+        place = (x, y, orientation)
+        self.placeOf[slot] = (cell, place)
+        places = self.cells.get(cell)
+        if places is None:
+            places = self.cells[cell] = {}
+        places[place] = places.get(place, 0) + 1
+
+    def update(self, slot: int, program: int, x: int, y: int, orientation: int, visible: bool):
+        """
+        Places ``slot`` again if it is in the grid. Slots that were removed stay out.
+        """
+        if slot in self.placeOf:
+            placed = self.placeOf[slot]
+            if placed is None or placed[1] != (x, y, orientation) or not visible:
+                self.place(slot, program, x, y, orientation, visible)
+
+    def remove(self, slot: int):
+        placed = self.placeOf.pop(slot, None)
+        if placed is not None:
+            cell, place = placed
+            places = self.cells[cell]
+            if places[place] > 1:
+                places[place] -= 1
+            else:
+                del places[place]
+                if not places:
+                    del self.cells[cell]
+
+    def near(self, program: int, x: int, y: int) -> typing.Iterator[typing.Tuple[int, int, int, int]]:
+        """
+        Yields ``(x, y, orientation, count)`` of every place of the entities of ``program`` whose 5x5 shape
+        can overlap one at ``(x, y)``.
+        """
+        size = self.cellSize
+        for cy in range((y - 4) // size, (y + 4) // size + 1):
+            for cx in range((x - 4) // size, (x + 4) // size + 1):
+                places = self.cells.get((program, cx, cy))
+                if places:
+                    for place, count in places.items():
+                        if -5 < place[0] - x < 5 and -5 < place[1] - y < 5:
+                            yield place + (count,)
+
+
+# bits of a 25-bit mask whose column stays within the 5x5 shape when it is shifted by dx columns
+keptColumns = {dx: sum(1 << (row * 5 + column) for row in range(5) for column in range(5) if 0 <= column + dx < 5) for dx in range(-4, 5)}
+
+
+def overlaps(a: int, b: int, dx: int, dy: int) -> bool:
+    """
+    Whether the 25-bit masks ``a`` and ``b`` share a cell, with ``b`` placed ``dx`` columns right of and ``dy`` rows below ``a``.
+    """
+    if not -5 < dx < 5 or not -5 < dy < 5:
+        return False
+    shift = dy * 5 + dx
+    b &= keptColumns[dx]
+    return a & (b << shift if shift >= 0 else b >> -shift) & 0x1ffffff != 0
+
+
+def frameRows(frame: bytes, width: int = SCREEN_WIDTH):
+    return [text for text, size in rowEncoder.encodeFrame(frame, width)]
+
+
+class Simulation:
+    """
+    Steps a project without any Discord I/O. Each ``frame`` is the palette index framebuffer of the screen as bytes.
+
+    Entities move in a world of ``worldSize`` (``[height, width]``) cells, of which the screen shows the part starting
+    at the camera. The camera stays inside the world. Only the entities in the cells of :attr:`grid` around the screen
+    are looked at to draw a frame, however large the world is and however many entities are elsewhere.
+
+    The sprites of the project take the first slots of :attr:`entities`, clones the rest.
+    At most ``maxClones`` clones exist at once; a clone whose code has ended and that can't be seen anymore
+    (hidden, or entirely out of the world) will never change again, so its slot is released for the next one.
+    Clones of sprites with touch lists are kept, since touching something can still run them.
+
+    After the code due on a tick has run, the entities of the sprites with touch lists are checked against their targets:
+    :attr:`placements` narrows the candidates down to the places nearby, then the 25-bit masks of the shapes are compared.
+    A touch list runs on the tick its target starts being touched, and again only after it stopped being touched.
+    """
+    def __init__(self, project: Project, maxClones: int = MAX_CLONES, worldSize: list = None):
+        self.project = project
+        self.maxClones = maxClones
+        self.compositor = Compositor(project.backgroundColor)
+        self.worldHeight, self.worldWidth = worldSize or (WORLD_HEIGHT, WORLD_WIDTH)
+        self.cameraX = 0
+        self.cameraY = 0
+        self.programs = project.compile()
+        self.atlases = [sprite.atlas for sprite in project.sprites]
+        # box of every orientation of every sprite, indexed by program * len(orientations) + orientation; (0, 0, 0, 0) if it is empty
+        self.boxes = np.array(
+            [atlas.boxes[orientation] or (0, 0, 0, 0) for atlas in self.atlases for orientation in range(len(orientations))], dtype=np.int64
+        ).reshape(-1, 4)
+        # the 25-bit mask of every orientation of every sprite, indexed like boxes
+        self.bits = [atlas.bits[orientation] for atlas in self.atlases for orientation in range(len(orientations))]
+        # sprites with touch lists, and the sprites they listen for touching
+        self.listeners = {index for index, program in enumerate(self.programs) if program.touches}
+        self.targets = {target for program in self.programs for target, entry in program.touches if target != TOUCH_EDGE}
+        self.placements = PlacementGrid()
+        # slots of the entities of the listeners
+        self.listening = set()
+        self.scheduler = TimingWheel(max([1] + [program.maxWait for program in self.programs]))
+        self.entities = EntityStore()
+        self.grid = SpatialHash()
+        # slots that ran code since the last frame, whose cell in the grid may be out of date
+        self.moved = []
+        self.originals = len(self.programs)
+        self.clones = 0
+        self.tick = 0
+        for index in range(self.originals):
+            self.track(self.entities.spawn(index, 0, 0))
+        for slot, program in enumerate(self.programs):
+            self.execute(slot, program.whenStarted, 0)
+            if not program.isEmpty(program.whenUpdated):
+                self.scheduler.schedule(1, slot, program.whenUpdated)
+        self.touch(0)
+
+    def step(self):
+        """
+        Advances one tick. Only entities with code due on this tick are touched.
+        """
+        self.tick += 1
+        for slot, pc in self.scheduler.pop(self.tick):
+            self.execute(slot, pc, self.tick)
+        self.touch(self.tick)
+
+    def track(self, slot: int):
+        """
+        Adds a new entity to the grids it belongs in.
+        """
+        entities = self.entities
+        program = entities.program[slot]
+        self.grid.insert(slot, entities.x[slot], entities.y[slot])
+        if program in self.listeners:
+            self.listening.add(slot)
+        if program in self.targets:
+            self.placements.place(slot, program, entities.x[slot], entities.y[slot], entities.orientation[slot], entities.visible[slot])
+
+    def settle(self):
+        """
+        Brings the grids up to date with the entities that ran code since the last call.
+        """
+        entities = self.entities
+        for slot in self.moved:
+            self.grid.move(slot, entities.x[slot], entities.y[slot])
+        if self.targets:
+            for slot in self.moved:
+                self.placements.update(
+                    slot, entities.program[slot], entities.x[slot], entities.y[slot], entities.orientation[slot], entities.visible[slot]
+                )
+        self.moved = []
+
+    def touch(self, tick: int):
+        """
+        Runs the touch lists whose target started being touched. Every entity is checked before any list runs,
+        so which one is checked first doesn't matter.
+        """
+        if not self.listening:
+            return
+        self.settle()
+        entities = self.entities
+        started = []
+        for slot in sorted(self.listening):
+            touching = self.touchingOf(slot)
+            if touching != entities.touching[slot]:
+                if touching & ~entities.touching[slot]:
+                    started.append((slot, touching & ~entities.touching[slot]))
+                entities.touching[slot] = touching
+        for slot, bits in started:
+            for index, (target, entry) in enumerate(self.programs[entities.program[slot]].touches):
+                if bits >> index & 1:
+                    self.execute(slot, entry, tick)
+
+    def touchingOf(self, slot: int) -> int:
+        """
+        Bits of the touch lists of ``slot`` whose target it touches in its current state.
+        """
+        entities = self.entities
+        if not entities.visible[slot]:
+            return 0
+        program = entities.program[slot]
+        x, y, orientation = entities.x[slot], entities.y[slot], entities.orientation[slot]
+        bits = self.bits[program * len(orientations) + orientation]
+        if not bits:
+            return 0
+        touching = 0
+        for index, (target, entry) in enumerate(self.programs[program].touches):
+            if target == TOUCH_EDGE:
+                box = self.atlases[program].boxes[orientation]
+                touched = x + box[0] <= 0 or y + box[1] <= 0 or x + box[2] >= self.worldWidth or y + box[3] >= self.worldHeight
+            else:
+                touched = False
+                for placeX, placeY, placeOrientation, count in self.placements.near(target, x, y):
+                    if target == program and count == 1 and (placeX, placeY, placeOrientation) == (x, y, orientation):
+                        # the entity itself
+                        continue
+                    if overlaps(bits, self.bits[target * len(orientations) + placeOrientation], placeX - x, placeY - y):
+                        touched = True
+                        break
+            if touched:
+                touching |= 1 << index
+        return touching
+
+    def execute(self, slot: int, pc: int, tick: int):
+        """
+        Runs the program of ``slot`` from ``pc`` until the end of the event list or a wait.
+        Whatever comes after a wait, and the next run of whenUpdated, are handed to the scheduler.
+        """
+        entities = self.entities
+        program = self.programs[entities.program[slot]]
+        ops, argA, argB = program.ops, program.argA, program.argB
+        xs, ys = entities.x, entities.y
+        self.moved.append(slot)
+        while True:
+            op = ops[pc]
+            if op == OP_MOVE:
+                xs[slot] += argA[pc]
+                ys[slot] += argB[pc]
+            elif op == OP_TURN:
+                entities.orientation[slot] = turnTable[entities.orientation[slot]][argA[pc]]
+            elif op == OP_MOVETO:
+                xs[slot] = argA[pc]
+                ys[slot] = argB[pc]
+            elif op == OP_SHOW:
+                entities.visible[slot] = True
+            elif op == OP_HIDE:
+                entities.visible[slot] = False
+            elif op == OP_DUPLICATE:
+                self.duplicate(slot, argA[pc], argB[pc], tick)
+            elif op == OP_CAMERA:
+                self.cameraX = min(max(argA[pc], 0), max(self.worldWidth - self.compositor.width, 0))
+                self.cameraY = min(max(argB[pc], 0), max(self.worldHeight - self.compositor.height, 0))
+            elif op == OP_WAIT:
+                self.scheduler.schedule(tick + argA[pc], slot, pc + 1)
+                return
+            elif op == OP_LOOP:
+                self.scheduler.schedule(tick + 1, slot, argA[pc])
+                return
+            else:
+                # whenDuplicated is the only code a clone runs without touching something, so once it ends the clone is done changing
+                if slot >= self.originals and not program.touches and not self.isSeen(slot):
+                    entities.release(slot)
+                    self.grid.remove(slot)
+                    self.placements.remove(slot)
+                    self.clones -= 1
+                return
+            pc += 1
+
+    def duplicate(self, slot: int, x: int, y: int, tick: int):
+        # clones can't duplicate themselves, not even from a touch list
+        if slot >= self.originals or self.clones >= self.maxClones:
+            return
+        entities = self.entities
+        program = entities.program[slot]
+        clone = entities.spawn(program, x, y, entities.orientation[slot], entities.visible[slot])
+        self.track(clone)
+        self.clones += 1
+        self.execute(clone, self.programs[program].whenDuplicated, tick)
+
+    def isSeen(self, slot: int) -> bool:
+        """
+        Whether ``slot`` draws anything in the world, where the camera can show it, in its current state.
+        """
+        entities = self.entities
+        if not entities.visible[slot]:
+            return False
+        box = self.atlases[entities.program[slot]].boxes[entities.orientation[slot]]
+        if box is None:
+            return False
+        x, y = entities.x[slot], entities.y[slot]
+        return x + box[2] > 0 and x + box[0] < self.worldWidth and y + box[3] > 0 and y + box[1] < self.worldHeight
+
+    def drawOrder(self) -> typing.List[int]:
+        """
+        Slots to draw, back to front, out of the entities the grid has around the screen.
+        Clones are drawn first, so the sprites of the project stay in front of their clones.
+
+        When there are many, those that draw nothing on the screen are left out, and only the last of the entities
+        drawn exactly alike (same sprite, orientation and position) is kept, since it covers every cell the others
+        would draw: clones duplicated in place pile up by the hundreds.
+        """
+        entities = self.entities
+        grid = self.grid
+        self.settle()
+        width, height = self.compositor.width, self.compositor.height
+        # a sprite reaches at most 4 cells right and down from its position
+        buckets = grid.query(self.cameraX - 4, self.cameraY - 4, self.cameraX + width, self.cameraY + height)
+        count = sum(map(len, buckets))
+        if count <= 32:
+            found = sorted(itertools.chain.from_iterable(buckets))
+            split = bisect.bisect_left(found, self.originals)
+            return found[split:] + found[:split]
+        if count * 2 > self.originals + self.clones:
+            # most entities are around the screen anyway: going through every slot at once is cheaper than gathering them
+            order = np.concatenate([np.arange(self.originals, len(entities)), np.arange(self.originals)])
+        else:
+            order = np.sort(np.fromiter(itertools.chain.from_iterable(buckets), dtype=np.int64, count=count))
+            split = np.searchsorted(order, self.originals)
+            order = np.concatenate([order[split:], order[:split]])
+        # views of the columns without copying them, so this costs only as much as the entities around the screen
+        x = np.frombuffer(entities.x, dtype=np.int64)[order] - self.cameraX
+        y = np.frombuffer(entities.y, dtype=np.int64)[order] - self.cameraY
+        kind = np.frombuffer(entities.program, dtype=np.uint16)[order] * np.int64(len(orientations)) + np.frombuffer(entities.orientation, dtype=np.uint8)[order]
+        box = self.boxes[kind]
+        seen = (
+            np.frombuffer(entities.visible, dtype=bool)[order] & (box[:, 2] > box[:, 0])
+            & (x + box[:, 2] > 0) & (x + box[:, 0] < width) & (y + box[:, 3] > 0) & (y + box[:, 1] < height)
+        )
+        order, x, y, kind = order[seen], x[seen], y[seen], kind[seen]
+        # a sprite box is at most 5 cells, so the positions of the entities left fit in (width + 10) x (height + 10)
+        key = (kind * (height + 10) + y + 5) * (width + 10) + x + 5
+        _, last = np.unique(key[::-1], return_index=True)
+        return order[np.sort(len(key) - 1 - last)].tolist()
+
+    def frame(self) -> bytes:
+        compositor = self.compositor
+        compositor.clear()
+        entities = self.entities
+        xs, ys, orientations, visible, programs = entities.x, entities.y, entities.orientation, entities.visible, entities.program
+        atlases = self.atlases
+        cameraX, cameraY = self.cameraX, self.cameraY
+        for slot in self.drawOrder():
+            if visible[slot]:
+                atlases[programs[slot]].draw(compositor, orientations[slot], xs[slot] - cameraX, ys[slot] - cameraY)
+        return compositor.frame.tobytes()
+
+    def stateKey(self):
+        """
+        Everything that decides the following frames: the state of every sprite and clone,
+        and the code still waiting to run, relative to the current tick.
+        Two ticks with equal keys are followed by the same frames forever.
+        """
+        return self.entities.state(), (self.cameraX, self.cameraY), tuple(self.scheduler.pending(self.tick))
+
+
+class Animation:
+    """
+    Frames of a simulated project. If the simulation came back to a state it had been in before,
+    the frames from ``loopStart`` on repeat forever, so ``frame`` can go past the simulated ticks.
+    ``compositeSeconds`` is how long compositing all of the frames took.
+    """
+    def __init__(self, frames: list[bytes], loopStart: int = None, compositeSeconds: float = 0.0):
+        self.frames = frames
+        self.loopStart = loopStart
+        self.compositeSeconds = compositeSeconds
+
+    @property
+    def loops(self):
+        return self.loopStart is not None
+
+    @property
+    def loopChanges(self) -> bool:
+        """
+        Whether the loop shows more than one frame. One that doesn't adds nothing past the simulated frames.
+        """
+        return self.loops and any(frame != self.frames[self.loopStart] for frame in self.frames[self.loopStart + 1:])
+
+    def toBytes(self):
+        return b"".join(self.frames)
+
+    @staticmethod
+    def fromBytes(data: bytes, frameSize: int, loopStart: int = None, compositeSeconds: float = 0.0):
+        # an animation of no ticks has no frames to tell the size of
+        if not frameSize:
+            return Animation([], loopStart, compositeSeconds)
+        return Animation([data[i:i + frameSize] for i in range(0, len(data), frameSize)], loopStart, compositeSeconds)
+
+    def frame(self, tick: int) -> bytes:
+        if tick < len(self.frames):
+            return self.frames[tick]
+        if not self.loops:
+            raise IndexError(tick)
+        return self.frames[self.loopStart + (tick - self.loopStart) % (len(self.frames) - self.loopStart)]
+
+
+def animate(project: Project, ticks: int = MAX_TICKS, maxClones: int = MAX_CLONES, cancelled: typing.Callable[[], bool] = None, worldSize: list = None) -> Animation:
+    """
+    Simulates ``project`` for up to ``ticks`` ticks as fast as possible, stopping early once the state repeats.
+    Raises :class:`CodeError` before the first frame if a sprite's code is invalid,
+    and :class:`SimulationCancelled` as soon as ``cancelled()`` returns True.
+    """
+    simulation = Simulation(project, maxClones, worldSize)
+    frames = []
+    composite = 0.0
+    seen = {simulation.stateKey(): -1}
+    while len(frames) < ticks:
+        if cancelled is not None and cancelled():
+            raise SimulationCancelled
+        simulation.step()
+        start = time.perf_counter()
+        frames.append(simulation.frame())
+        composite += time.perf_counter() - start
+        key = simulation.stateKey()
+        if key in seen:
+            return Animation(frames, seen[key] + 1, composite)
+        seen[key] = len(frames) - 1
+    return Animation(frames, compositeSeconds=composite)
+
+
+def simulate(project: Project, ticks: int = MAX_TICKS):
+    """
+    Yields the frame of each of the first ``ticks`` ticks of ``project``.
+    """
+    animation = animate(project, ticks)
+    for tick in range(ticks):
+        if tick >= len(animation.frames) and not animation.loops:
+            return
+        yield animation.frame(tick)
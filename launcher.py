@@ -0,0 +1,462 @@
+"""
+Runs the bot as several worker processes, each connecting its own share of the gateway shards.
+The launcher connects no shard itself: it migrates the storage once, asks Discord how many shards to use,
+hands them out to the workers, spaces out their IDENTIFYs and registers the slash commands once for all of them.
+
+    python launcher.py                          # settings from mainData["launcher"], one worker per core
+    python launcher.py --workers 4 --shards 8
+    python launcher.py --offline                # against a local stand-in of Discord, no token or network needed
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import runpy
+import sys
+import time
+import typing
+
+import aiohttp
+import dico
+from aiohttp import web
+from dico.model.gateway import GetGateway
+
+from commands import CommandRegistrar, applicationOf, schemaOf
+from storage import Storage
+
+API_URL = "https://discord.com/api/v10"
+# Discord lets each rate limit bucket (shard % max_concurrency) identify once every 5 seconds
+IDENTIFY_INTERVAL = 5.0
+LOG_FORMAT = "%(asctime)s %(processName)s %(name)s: %(message)s"
+
+logger = logging.getLogger("disanimator.launcher")
+
+# set in every worker process before main.py runs, None when main.py runs on its own
+worker = None
+
+
+def shardOf(guild: int, shardCount: int) -> int:
+    return (int(guild) >> 22) % shardCount
+
+
+class IdentifyGate:
+    """
+    Spaces out the IDENTIFYs of every worker process, so shards of the same rate limit bucket identify
+    at least ``interval`` seconds apart. It lives in shared memory and is handed to each worker when it starts.
+    """
+    def __init__(self, context, maxConcurrency: int = 1, interval: float = IDENTIFY_INTERVAL):
+        self.maxConcurrency = maxConcurrency
+        self.interval = interval
+        self.lock = context.Lock()
+        self.last = context.RawArray('d', maxConcurrency)
+
+    def reserve(self, shard: int) -> float:
+        """
+        Takes the next free turn of the bucket of ``shard``. Returns how long to wait for it.
+        """
+        bucket = shard % self.maxConcurrency
+        with self.lock:
+            now = time.time()
+            turn = max(now, self.last[bucket] + self.interval)
+            self.last[bucket] = turn
+        return turn - now
+
+    async def wait(self, shard: int):
+        await asyncio.sleep(self.reserve(shard))
+
+
+class Worker:
+    """
+    What a worker process got from the launcher. main.py builds its client with :meth:`client`
+    and reports to the launcher through :meth:`attach`.
+    """
+    def __init__(self, index: int, shards: list, shardCount: int, gateway: dict, api: str, cores: int, gate: IdentifyGate, reports):
+        self.index = index
+        self.shards = shards
+        self.shardCount = shardCount
+        self.gateway = gateway
+        self.api = api
+        self.cores = cores
+        self.gate = gate
+        self.reports = reports
+
+    def client(self, token: str, **kwargs) -> "ShardedClient":
+        bot = ShardedClient(self, token=token, **kwargs)
+        bot.http.BASE_URL = self.api
+        return bot
+
+    def attach(self, bot: dico.Client, interaction):
+        """
+        Sends the commands of ``interaction`` to the launcher, which registers them, and reports every shard that gets ready.
+        """
+        self.reports.put(("commands", self.index, schemaOf(interaction.export_commands())))
+
+        async def ready(event):
+            self.reports.put(("ready", self.index, event.shard_id, [guild["id"] for guild in event.guilds]))
+        bot.on_("ready", ready)
+
+    def path(self, path: str) -> str:
+        """
+        ``path`` with the index of the worker before its extension, for files every worker writes on its own.
+        """
+        root, extension = os.path.splitext(path)
+        return f"{root}.{self.index}{extension}"
+
+
+class ShardedClient(dico.Client):
+    """
+    A :class:`dico.Client` connecting only the shards of its worker, each once the :class:`IdentifyGate` lets it.
+    Everything after connecting is left to dico's monoshard mode, which already keeps one websocket per shard.
+    """
+    def __init__(self, worker: Worker, **kwargs):
+        super().__init__(monoshard=True, shard_count=worker.shardCount, **kwargs)
+        self.worker = worker
+
+    async def start(self, reconnect_on_unknown_disconnect: bool = False, compress: bool = False):
+        gateway = GetGateway(self.worker.gateway)
+        # the shard attributes are private to dico.Client, hence the mangled names
+        self._Client__shard_ids = list(self.worker.shards)
+        for shard in self.worker.shards:
+            await self.worker.gate.wait(shard)
+            ws = await self._Client__ws_class.connect_without_request(
+                gateway, self.http, self.intents, self.events, reconnect_on_unknown_disconnect, compress,
+                shard=[shard, self.shard_count]
+            )
+            self._Client__shards[shard] = ws
+            await ws.receive_once()
+            self.loop.create_task(ws.run())
+
+    def get_shard_id(self, guild) -> int:
+        return shardOf(guild, self.shard_count)
+
+    def get_shard(self, guild):
+        return self._Client__shards.get(self.get_shard_id(guild))
+
+
+def runWorker(config: dict, gate: IdentifyGate, reports, level: int):
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    # main.py imports this file as ``launcher``, which is not the module this function runs in
+    import launcher
+    launcher.worker = launcher.Worker(gate=gate, reports=reports, **config)
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), run_name="__main__")
+
+
+class Launcher:
+    """
+    Starts the workers and looks after them: restarts the ones that exit, registers the commands
+    the first one reports if they changed, and logs when every shard is ready.
+    """
+    def __init__(
+        self, token: str, api: str = API_URL, workers: int = None, shardCount: int = None, respawnSeconds: float = 5.0,
+        manifest: str = "data/commands.json"
+    ):
+        self.token = token
+        self.api = api
+        self.registrar = CommandRegistrar(self.request, manifest)
+        self.workerCount = workers or os.cpu_count() or 1
+        self.shardCount = shardCount
+        self.respawnSeconds = respawnSeconds
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.gate = None
+        self.gateway = None
+        self.assignments = []
+        self.processes = {}
+        self.session = None
+        self.commands = None
+        # guild IDs every shard reported ready with
+        self.ready = {}
+        self.allReady = asyncio.Event()
+        self.registered = asyncio.Event()
+        self.started = 0.0
+        self.stopping = False
+
+    async def request(self, method: str, route: str, **kwargs):
+        async with self.session.request(method, self.api + route, headers={"Authorization": f"Bot {self.token}"}, **kwargs) as response:
+            response.raise_for_status()
+            return None if response.status == 204 else await response.json()
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+        gateway = await self.request("GET", "/gateway/bot")
+        self.shardCount = self.shardCount or gateway["shards"]
+        maxConcurrency = (gateway.get("session_start_limit") or {}).get("max_concurrency", 1)
+        self.gate = IdentifyGate(self.context, maxConcurrency)
+        self.gateway = {"url": gateway["url"], "shards": self.shardCount}
+        workers = min(self.workerCount, self.shardCount)
+        # consecutive shards are in different buckets, so every worker can identify in parallel with the others
+        self.assignments = [list(range(index, self.shardCount, workers)) for index in range(workers)]
+        self.started = time.monotonic()
+        logger.info("%d shards on %d workers, %d identifying at a time", self.shardCount, workers, maxConcurrency)
+        for index in range(workers):
+            self.spawn(index)
+
+    def spawn(self, index: int):
+        if self.stopping:
+            return
+        config = {
+            "index": index,
+            "shards": self.assignments[index],
+            "shardCount": self.shardCount,
+            "gateway": self.gateway,
+            "api": self.api,
+            # the pools of all workers share the cores
+            "cores": max(1, (os.cpu_count() or 1) // len(self.assignments))
+        }
+        process = self.context.Process(
+            target=runWorker, args=(config, self.gate, self.reports, logging.getLogger().level), name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            try:
+                report = await loop.run_in_executor(None, self.reports.get, True, 0.5)
+            except queue.Empty:
+                report = None
+            if report is not None:
+                self.receive(*report)
+            for index, process in self.processes.items():
+                if process is not None and not process.is_alive() and not self.stopping:
+                    logger.warning("worker %d exited with %s, restarting it in %gs", index, process.exitcode, self.respawnSeconds)
+                    self.processes[index] = None
+                    for shard in self.assignments[index]:
+                        self.ready.pop(shard, None)
+                    loop.call_later(self.respawnSeconds, self.spawn, index)
+
+    def receive(self, kind: str, index: int, *args):
+        if kind == "commands":
+            commands, = args
+            if self.commands is None:
+                self.commands = commands
+                asyncio.ensure_future(self.register(commands))
+            elif commands != self.commands:
+                logger.warning("worker %d has different commands than the ones registered", index)
+        elif kind == "ready":
+            shard, guilds = args
+            self.ready[shard] = guilds
+            logger.info(
+                "shard %d ready on worker %d with %d guilds, %.1fs after launch", shard, index, len(guilds), time.monotonic() - self.started
+            )
+            if len(self.ready) == self.shardCount and not self.allReady.is_set():
+                logger.info("all %d shards ready after %.1fs", self.shardCount, time.monotonic() - self.started)
+                self.allReady.set()
+
+    async def register(self, schema: dict):
+        start = time.monotonic()
+        try:
+            application = applicationOf(self.token) or (await self.request("GET", "/oauth2/applications/@me"))["id"]
+            requests = await self.registrar.sync(application, schema)
+        except aiohttp.ClientError:
+            logger.exception("failed to register commands")
+            return
+        if requests:
+            logger.info("registered the changed commands in %d requests, %.2fs", requests, time.monotonic() - start)
+        else:
+            logger.info("commands unchanged since the last registration")
+        self.registered.set()
+
+    async def stop(self):
+        self.stopping = True
+        for process in self.processes.values():
+            if process is not None and process.is_alive():
+                process.terminate()
+        loop = asyncio.get_running_loop()
+        for process in self.processes.values():
+            if process is not None:
+                await loop.run_in_executor(None, process.join)
+        if self.session is not None:
+            await self.session.close()
+
+
+APPLICATION_ID = "1"
+STAND_IN_USER = {"id": APPLICATION_ID, "username": "disanimator", "discriminator": "0000", "avatar": None, "bot": True}
+
+
+class GatewayStandIn:
+    """
+    A local stand-in for the parts of Discord the launcher and its workers use: ``/gateway/bot``, the bot user,
+    command registration, and a gateway answering each IDENTIFY with READY for the guilds of the shard.
+    It records every IDENTIFY and registration, so sharding can be checked offline with :meth:`check`.
+    """
+    def __init__(self, guilds: int = 1000, shards: int = 4, maxConcurrency: int = 1, seed: int = 0):
+        rng = random.Random(seed)
+        self.guilds = [(rng.getrandbits(42) << 22) | rng.getrandbits(22) for _ in range(guilds)]
+        self.shards = shards
+        self.maxConcurrency = maxConcurrency
+        self.identifies = []
+        self.registrations = []
+        self.runner = None
+        self.host = None
+
+    async def start(self, host: str = "127.0.0.1") -> str:
+        """
+        Starts serving on a free port. Returns the API URL.
+        """
+        app = web.Application()
+        app.router.add_get("/api/gateway/bot", self.gatewayBot)
+        app.router.add_get("/api/users/@me", self.user)
+        app.router.add_get("/api/oauth2/applications/@me", self.application)
+        for scope in ("/api/applications/{application}", "/api/applications/{application}/guilds/{guild}"):
+            app.router.add_put(scope + "/commands", self.register)
+            app.router.add_post(scope + "/commands", self.register)
+            app.router.add_delete(scope + "/commands/{command}", self.register)
+        app.router.add_get("/gateway", self.gateway)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, 0).start()
+        self.host = f"{host}:{self.runner.addresses[0][1]}"
+        return f"http://{self.host}/api"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def gatewayBot(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "url": f"ws://{self.host}/gateway",
+            "shards": self.shards,
+            "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": self.maxConcurrency}
+        })
+
+    async def user(self, request: web.Request) -> web.Response:
+        return web.json_response(STAND_IN_USER)
+
+    async def application(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": APPLICATION_ID, "name": "disanimator"})
+
+    async def register(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.can_read_body else None
+        self.registrations.append((request.method, request.path, body))
+        if body is None:
+            return web.Response(status=204)
+        if isinstance(body, list):
+            return web.json_response([dict(command, id=str(len(self.registrations) * 100 + i)) for i, command in enumerate(body)])
+        return web.json_response(dict(body, id=str(len(self.registrations) * 100)))
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"op": 10, "d": {"heartbeat_interval": 41250}, "s": None, "t": None})
+        sequence = 0
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            if payload["op"] == 1:
+                await ws.send_json({"op": 11, "d": None, "s": None, "t": None})
+            elif payload["op"] == 2:
+                shard, shardCount = payload["d"].get("shard", [0, 1])
+                self.identifies.append((shard, time.time()))
+                sequence += 1
+                await ws.send_json({"op": 0, "s": sequence, "t": "READY", "d": {
+                    "v": 10,
+                    "user": STAND_IN_USER,
+                    "guilds": [{"id": str(guild), "unavailable": True} for guild in self.guilds if shardOf(guild, shardCount) == shard],
+                    "session_id": f"stand-in-{shard}",
+                    "resume_gateway_url": f"ws://{self.host}/gateway",
+                    "shard": [shard, shardCount],
+                    "application": {"id": APPLICATION_ID, "flags": 0}
+                }})
+        return ws
+
+    def check(self, ready: typing.Dict[int, list]) -> typing.List[str]:
+        """
+        What went wrong, given the guild IDs each shard got ready with: every shard has to identify exactly once,
+        no sooner after the previous IDENTIFY of its bucket than Discord allows, and get exactly its own guilds.
+        """
+        problems = []
+        identified = collections.Counter(shard for shard, _ in self.identifies)
+        last = {}
+        for shard, moment in sorted(self.identifies, key=lambda identify: identify[1]):
+            bucket = shard % self.maxConcurrency
+            # a little slack for the time between the gate opening and the IDENTIFY arriving here
+            if bucket in last and moment - last[bucket] < IDENTIFY_INTERVAL - 0.5:
+                problems.append(f"shard {shard} identified {moment - last[bucket]:.2f}s after the previous one of bucket {bucket}")
+            last[bucket] = moment
+        expected = collections.defaultdict(set)
+        for guild in self.guilds:
+            expected[shardOf(guild, self.shards)].add(str(guild))
+        for shard in range(self.shards):
+            if identified[shard] != 1:
+                problems.append(f"shard {shard} identified {identified[shard]} times")
+            if set(ready.get(shard, ())) != expected[shard]:
+                problems.append(f"shard {shard} got ready with {len(ready.get(shard, ()))} guilds instead of {len(expected[shard])}")
+        return problems
+
+
+
+async def launch(args: argparse.Namespace, mainData: dict) -> int:
+    config = mainData.get("launcher", {})
+    shardCount = args.shards or config.get("shards")
+    api = config.get("api", API_URL)
+    standIn = None
+    if args.offline:
+        standIn = GatewayStandIn(args.guilds, shardCount or 4, args.max_concurrency)
+        api = await standIn.start()
+
+    # once here, before any worker opens the database
+    database = Storage(mainData.get("database", "data/disanimator.db"))
+    migrated = database.migrate("data")
+    if migrated:
+        logger.info("imported %d json files into %s", migrated, database.path)
+    database.close()
+
+    # the stand-in's commands are not the real ones, so they get their own manifest
+    manifest = "data/commands.offline.json" if args.offline else mainData.get("commandManifest", "data/commands.json")
+    launcher = Launcher(
+        mainData["token"], api, args.workers or config.get("workers"), shardCount, config.get("respawnSeconds", 5.0), manifest
+    )
+    try:
+        await launcher.start()
+        if standIn is None:
+            await launcher.watch()
+            return 0
+        watching = asyncio.ensure_future(launcher.watch())
+        timeout = 60 + launcher.shardCount * IDENTIFY_INTERVAL / standIn.maxConcurrency
+        try:
+            await asyncio.wait_for(asyncio.gather(launcher.allReady.wait(), launcher.registered.wait()), timeout)
+        except asyncio.TimeoutError:
+            logger.error("not every shard got ready within %gs", timeout)
+        problems = standIn.check(launcher.ready)
+        if not launcher.registered.is_set():
+            problems.append("the commands were not registered")
+        for problem in problems:
+            logger.error(problem)
+        if not problems:
+            logger.info("offline check passed: %d guilds over %d shards on %d workers", len(standIn.guilds), launcher.shardCount, len(launcher.assignments))
+        launcher.stopping = True
+        await watching
+        return 1 if problems else 0
+    finally:
+        await launcher.stop()
+        if standIn is not None:
+            await standIn.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the bot as worker processes that share the gateway shards.")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--shards", type=int, help="shards in total, the number Discord recommends by default")
+    parser.add_argument("--offline", action="store_true", help="run against a local stand-in of Discord and check the sharding")
+    parser.add_argument("--guilds", type=int, default=1000, help="guilds of the stand-in")
+    parser.add_argument("--max-concurrency", type=int, default=2, help="identify buckets of the stand-in")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    with open("data/mainData.json", "r") as f:
+        mainData = json.load(f)
+    try:
+        return asyncio.run(launch(args, mainData))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import typing
+
+from cache import AnimationCache, animationKey
+from engine import MAX_CLONES, MAX_TICKS, WORLD_HEIGHT, WORLD_WIDTH, Animation, Project, animate
+
+logger = logging.getLogger("disanimator")
+
+# cancel flag of every job slot, handed to each worker process by initWorker
+cancelFlags = None
+
+
+def initWorker(flags):
+    global cancelFlags
+    cancelFlags = flags
+
+
+def runJob(projectData: dict, slot: int, ticks: int, maxClones: int, worldSize: list):
+    """
+    Runs in a worker process. Returns the frames joined into one bytes object, the size of a frame, the loop start
+    and the compositing time.
+    """
+    cancelled = None if slot is None else (lambda: cancelFlags[slot] != 0)
+    animation = animate(Project.from_json(projectData), ticks, maxClones, cancelled, worldSize)
+    return animation.toBytes(), len(animation.frames[0]) if animation.frames else 0, animation.loopStart, animation.compositeSeconds
+
+
+def estimateCost(project: Project, ticks: int):
+    """
+    Rough number of instructions a simulation runs: every instruction of every sprite once per tick,
+    times the clones that each duplicate in whenUpdated can add over the ticks.
+    """
+    cost = 0
+    for sprite in project.sprites:
+        code = sprite.code
+        size = 1 + len(code.whenStarted) + len(code.whenUpdated) + len(code.whenDuplicated) + len(code.whenTouchingEdge)
+        size += sum(len(codes) for target, codes in code.whenTouching)
+        duplicates = len([c for c in code.whenUpdated if c and c[0] == "duplicate"])
+        cost += size * ticks * (1 + duplicates * ticks // 2)
+    return cost
+
+
+class SimulationJob:
+    """
+    ``key`` is the cache key the animation is stored under once it is done, None if the pool has no cache.
+    """
+    def __init__(self, pool: "SimulationPool", animation: Animation = None, future: asyncio.Future = None, slot: int = None, key: str = None):
+        self.pool = pool
+        self.animation = animation
+        self.future = future
+        self.slot = slot
+        self.key = key
+
+    def cancel(self):
+        if self.slot is not None:
+            self.pool.flags[self.slot] = 1
+        if self.future is not None:
+            self.future.cancel()
+
+    async def result(self) -> Animation:
+        """
+        Raises :class:`asyncio.CancelledError` or :class:`engine.SimulationCancelled` if the job was cancelled.
+        """
+        if self.animation is None:
+            data, frameSize, loopStart, compositeSeconds = await self.future
+            self.animation = Animation.fromBytes(data, frameSize, loopStart, compositeSeconds)
+        if self.key is not None:
+            self.pool.store(self.key, self.animation)
+            self.key = None
+        return self.animation
+
+
+class SimulationPool:
+    """
+    Simulates heavy projects in worker processes, so one project with many clones can't stall the event loop
+    that serves everyone else. Projects cheaper than ``inlineCost`` are simulated inline,
+    where the round trip to a worker wouldn't pay off. ``size`` 0 keeps everything inline.
+    ``worldSize`` (``[height, width]``) is the world every project is simulated in.
+    Finished animations are stored in ``cache`` if one is given, and :meth:`cached` reads them back.
+    """
+    def __init__(
+        self, size: int = None, maxTicks: int = MAX_TICKS, maxClones: int = MAX_CLONES, inlineCost: int = 100000, slots: int = 1024,
+        worldSize: list = None, cache: AnimationCache = None
+    ):
+        self.size = (os.cpu_count() or 1) if size is None else size
+        self.maxTicks = maxTicks
+        self.maxClones = maxClones
+        self.worldSize = worldSize or [WORLD_HEIGHT, WORLD_WIDTH]
+        self.inlineCost = inlineCost
+        self.context = multiprocessing.get_context("spawn")
+        self.flags = self.context.RawArray('b', slots)
+        self.freeSlots = list(range(slots))
+        self.cache = cache
+        self.executor = None
+
+    def key(self, project: Project, ticks: int = None) -> str:
+        return animationKey(project, self.maxTicks if ticks is None else min(ticks, self.maxTicks), self.maxClones, self.worldSize)
+
+    async def cached(self, project: Project, ticks: int = None) -> typing.Optional[Animation]:
+        """
+        The animation of a project with the same content simulated before, read from the cache off the event loop.
+        """
+        if self.cache is None:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.cache.get, self.key(project, ticks))
+
+    def store(self, key: str, animation: Animation):
+        """
+        Writes the animation to the cache off the event loop. Nobody waits for the write, so a failure is only logged.
+        """
+        def logFailure(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"failed to store animation {key} in the cache", exc_info=future.exception())
+
+        asyncio.get_running_loop().run_in_executor(None, self.cache.put, key, animation).add_done_callback(logFailure)
+
+    def submit(self, project: Project, ticks: int = None) -> SimulationJob:
+        ticks = self.maxTicks if ticks is None else min(ticks, self.maxTicks)
+        key = None if self.cache is None else self.key(project, ticks)
+        if self.size == 0 or estimateCost(project, ticks) < self.inlineCost:
+            return SimulationJob(self, animation=animate(project, ticks, self.maxClones, worldSize=self.worldSize), key=key)
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.size, mp_context=self.context, initializer=initWorker, initargs=(self.flags,)
+            )
+        # without a free slot the job can still be cancelled while it is queued, just not once it runs
+        slot = self.freeSlots.pop() if self.freeSlots else None
+        if slot is not None:
+            self.flags[slot] = 0
+        future = self.executor.submit(runJob, project.to_json(), slot, ticks, self.maxClones, self.worldSize)
+        if slot is not None:
+            loop = asyncio.get_running_loop()
+            # the slot can only be reused once the worker is done reading its flag
+            future.add_done_callback(lambda f: loop.call_soon_threadsafe(self.freeSlots.append, slot))
+        return SimulationJob(self, future=asyncio.wrap_future(future), slot=slot, key=key)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
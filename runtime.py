@@ -0,0 +1,175 @@
+import asyncio
+import logging
+
+import dico
+import dico_interaction
+
+from encoder import embedSize, screenFields
+from engine import Project, SimulationCancelled
+from pool import SimulationPool
+from stats import compositeTime, editFailures, editTime, encodeTime, simulateTime, stats
+
+logger = logging.getLogger("disanimator")
+
+# seconds between two frames of a playback
+TICK_SECONDS = 0.8
+# how long an animation that loops can be played for
+MAX_LOOP_TICKS = 300
+
+sentFrames = stats.counter("frames_sent_total", "Frames sent as message edits.")
+skippedFrames = stats.counter("frames_skipped_total", "Frames not sent because they were the same as the last one.")
+coalescedFrames = stats.counter("frames_coalesced_total", "Frames dropped because the previous edit was still in flight.")
+
+
+class Runtime:
+    """
+    Plays ``project`` on the message of ``ctx``. ``id`` is the key of the runtime in :attr:`TickDriver.runtimes`,
+    the ID of ``ctx`` unless the message belongs to an editor restored from another interaction.
+    """
+    def __init__(self, project: Project, bot: dico.Client, ctx: dico_interaction.InteractionContext, embed: dico.Embed, id: int = None):
+        self.project = project
+        self.id = int(ctx.id) if id is None else id
+        project.validate()
+        self.job = None
+        self.animation = None
+        self.frames = []
+        self.ctx = ctx
+        self.bot = bot
+        self.embed = embed
+        # everything in the embed but the two screen fields
+        self.reserved = embedSize(embed, skip=(1, 2))
+        self.isStopped = False
+        self.finished = asyncio.Event()
+        self.startTick = 0
+        self.tick = 0
+        self.editing = None
+        self.lastFrame = None
+        self.sentFrames = 0
+        self.skippedFrames = 0
+        self.coalescedFrames = 0
+        self.driver = None
+
+    async def prepare(self, pool: SimulationPool):
+        """
+        Simulates the whole animation up front, in the pool if it is heavy; the driver only plays it back.
+        A project with the same content that was played before is read from the pool's cache instead.
+        """
+        self.animation = await pool.cached(self.project)
+        if self.animation is None:
+            if self.isStopped:
+                return
+            try:
+                with stats.time(simulateTime):
+                    # inline projects are simulated right in submit
+                    self.job = pool.submit(self.project)
+                    self.animation = await self.job.result()
+            except (asyncio.CancelledError, SimulationCancelled):
+                if not self.isStopped:
+                    raise
+                return
+            if self.animation.frames:
+                stats.observe(compositeTime, self.animation.compositeSeconds / len(self.animation.frames))
+        # a loop that doesn't change the picture would only hold the playback
+        if self.animation.loopChanges:
+            self.frames = [self.animation.frame(tick) for tick in range(MAX_LOOP_TICKS)]
+        else:
+            self.frames = self.animation.frames
+
+    def advance(self, tick: int):
+        """
+        Called by the driver on every tick of the shared clock.
+        """
+        if self.editing is not None and not self.editing.done():
+            # the last edit hasn't come back yet, the frames due meanwhile get coalesced
+            return
+        index = tick - self.startTick
+        if self.isStopped or index >= len(self.frames):
+            self.finish()
+            return
+        self.coalescedFrames += index - self.tick
+        self.tick = index + 1
+        frame = self.frames[index]
+        if frame == self.lastFrame:
+            # a run of identical frames is held as one edit
+            self.skippedFrames += 1
+            return
+        self.lastFrame = frame
+        self.sentFrames += 1
+        self.editing = asyncio.ensure_future(self.render(frame))
+
+    def finish(self):
+        if self.finished.is_set():
+            return
+        if self.driver is not None and self.driver.runtimes.get(self.id) is self:
+            del self.driver.runtimes[self.id]
+        self.finished.set()
+        logger.debug(f"{self.id}: sent {self.sentFrames}, skipped {self.skippedFrames}, coalesced {self.coalescedFrames} frames")
+        stats.inc(sentFrames, self.sentFrames)
+        stats.inc(skippedFrames, self.skippedFrames)
+        stats.inc(coalescedFrames, self.coalescedFrames)
+
+    async def stop(self):
+        self.isStopped = True
+        if self.job is not None:
+            self.job.cancel()
+
+    async def render(self, frame: bytes):
+        with stats.time(encodeTime):
+            fields, size = screenFields(frame, self.reserved)
+        for field, (name, value) in zip(self.embed.fields[1:3], fields):
+            field.name = name
+            field.value = value
+        try:
+            with stats.time(editTime):
+                await self.ctx.edit_original_response(embed=self.embed)
+        except Exception:
+            stats.inc(editFailures)
+            logger.exception(f"{self.id}: failed to edit the screen")
+            self.isStopped = True
+
+
+class TickDriver:
+    """
+    One clock for every playing :class:`Runtime`. Each tick advances all of them in a single pass,
+    instead of every runtime running its own loop and waits.
+    Runtimes are simulated in ``pool``, or inline if it is None.
+    """
+    def __init__(self, interval: float = TICK_SECONDS, pool: SimulationPool = None):
+        self.interval = interval
+        self.pool = SimulationPool(size=0) if pool is None else pool
+        self.runtimes = {}
+        self.tick = 0
+        self.task = None
+
+    def add(self, runtime: Runtime):
+        runtime.driver = self
+        runtime.startTick = self.tick
+        self.runtimes[runtime.id] = runtime
+        runtime.advance(self.tick)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def play(self, runtime: Runtime):
+        # registered while it is being prepared too, so the stop button can cancel the simulation
+        runtime.driver = self
+        self.runtimes[runtime.id] = runtime
+        try:
+            await runtime.prepare(self.pool)
+        except Exception:
+            logger.exception(f"{runtime.id}: simulation failed")
+            runtime.isStopped = True
+        if runtime.isStopped:
+            runtime.finish()
+            return
+        self.add(runtime)
+        await runtime.finished.wait()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        nextTime = loop.time()
+        while self.runtimes:
+            nextTime += self.interval
+            await asyncio.sleep(max(nextTime - loop.time(), 0))
+            self.tick += 1
+            for runtime in list(self.runtimes.values()):
+                runtime.advance(self.tick)
@@ -0,0 +1,209 @@
+import math
+import sqlite3
+import typing
+import unicodedata
+
+schema = """
+CREATE TABLE IF NOT EXISTS searchDocuments (
+    kind TEXT NOT NULL,
+    author INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    authorName TEXT NOT NULL,
+    PRIMARY KEY (kind, author, id)
+);
+CREATE TABLE IF NOT EXISTS searchPostings (
+    gram TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    author INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (gram, kind, author, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS searchGrams (
+    gram TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# how much a gram counts depending on where it was found
+NAME_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.5
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def ngrams(text: str, n: int = 2) -> typing.Set[str]:
+    """
+    Character n-grams of every word in ``text``. Hangul syllables are single characters,
+    so bigrams match any two consecutive syllables of a name. Words shorter than ``n`` are kept whole.
+    """
+    grams = set()
+    for word in normalize(text).split():
+        if len(word) < n:
+            grams.add(word)
+        else:
+            grams.update(word[i:i + n] for i in range(len(word) - n + 1))
+    return grams
+
+
+class SearchResult:
+    def __init__(self, kind: str, author: int, id: int, name: str, authorName: str, score: float):
+        self.kind = kind
+        self.author = author
+        self.id = id
+        self.name = name
+        self.authorName = authorName
+        self.score = score
+
+
+class SearchIndex:
+    """
+    Inverted index from name n-grams to projects and sprites, stored next to them in the SQLite database.
+
+    It holds no connection of its own: :class:`storage.Storage` passes its connection in,
+    so documents are indexed in the same transaction that saves them.
+    """
+    def __init__(self, candidates: int = 100, maxPostings: int = 2000, maxGrams: int = 100):
+        self.candidates = candidates
+        self.maxPostings = maxPostings
+        self.maxGrams = maxGrams
+
+    def create(self, connection: sqlite3.Connection):
+        connection.executescript(schema)
+        connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('searchDocuments', '0')")
+
+    def add(self, connection: sqlite3.Connection, kind: str, author: int, id: int, name: str, authorName: str = ""):
+        """
+        Indexes a document, replacing it if it was indexed before.
+        """
+        self.remove(connection, kind, author, id)
+        weights = {gram: AUTHOR_WEIGHT for gram in ngrams(authorName)}
+        weights.update({gram: NAME_WEIGHT for gram in ngrams(name)})
+        connection.execute(
+            "INSERT INTO searchDocuments (kind, author, id, name, authorName) VALUES (?, ?, ?, ?, ?)",
+            (kind, author, id, name, authorName)
+        )
+        connection.executemany(
+            "INSERT INTO searchPostings (gram, kind, author, id, weight) VALUES (?, ?, ?, ?, ?)",
+            [(gram, kind, author, id, weight) for gram, weight in weights.items()]
+        )
+        connection.executemany(
+            "INSERT INTO searchGrams (gram, df) VALUES (?, 1) ON CONFLICT (gram) DO UPDATE SET df = df + 1",
+            [(gram,) for gram in weights]
+        )
+        connection.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'searchDocuments'")
+
+    def remove(self, connection: sqlite3.Connection, kind: str, author: int, id: int):
+        row = connection.execute(
+            "SELECT name, authorName FROM searchDocuments WHERE kind = ? AND author = ? AND id = ?", (kind, author, id)
+        ).fetchone()
+        if row is None:
+            return
+        # postings are keyed by gram first, so they are found again from the grams of the indexed names
+        grams = ngrams(row[0]) | ngrams(row[1])
+        connection.executemany("UPDATE searchGrams SET df = df - 1 WHERE gram = ?", [(gram,) for gram in grams])
+        connection.executemany(
+            "DELETE FROM searchPostings WHERE gram = ? AND kind = ? AND author = ? AND id = ?",
+            [(gram, kind, author, id) for gram in grams]
+        )
+        connection.execute("DELETE FROM searchDocuments WHERE kind = ? AND author = ? AND id = ?", (kind, author, id))
+        connection.execute("UPDATE meta SET value = CAST(value AS INTEGER) - 1 WHERE key = 'searchDocuments'")
+
+    def rebuild(self, connection: sqlite3.Connection):
+        """
+        Indexes every stored project and sprite. Only needed for databases created before the index existed.
+        """
+        connection.execute("DELETE FROM searchPostings")
+        connection.execute("DELETE FROM searchGrams")
+        connection.execute("DELETE FROM searchDocuments")
+        connection.execute("UPDATE meta SET value = '0' WHERE key = 'searchDocuments'")
+        for table, kind in (("projects", "project"), ("sprites", "sprite")):
+            for author, id, name in connection.execute(f"SELECT author, id, name FROM {table}").fetchall():
+                self.add(connection, kind, author, id, name)
+
+    def gramFrequencies(self, connection: sqlite3.Connection, query: str) -> typing.Dict[str, int]:
+        """
+        Document frequency of every indexed gram of ``query``. One-letter words match every gram starting with them.
+        """
+        frequencies = {}
+        for gram in ngrams(query):
+            if len(gram) == 1:
+                rows = connection.execute(
+                    "SELECT gram, df FROM searchGrams WHERE gram >= ? AND gram < ? AND df > 0",
+                    (gram, chr(ord(gram) + 1))
+                )
+            else:
+                rows = connection.execute("SELECT gram, df FROM searchGrams WHERE gram = ? AND df > 0", (gram,))
+            frequencies.update(rows)
+        return frequencies
+
+    def search(self, connection: sqlite3.Connection, query: str, page: int = 1, pageSize: int = 10) -> typing.Tuple[int, bool, typing.List[SearchResult]]:
+        """
+        Returns the number of ranked results, whether more documents matched than the ``candidates`` that were ranked,
+        and the results on ``page`` (1-based).
+
+        Candidates are gathered from the rarest grams of the query only, reading at most ``maxPostings`` postings,
+        so a query containing very common grams does not scan most of the index; the candidates are then ranked
+        by every gram of the query. If even the rarest gram is too common, the candidates are simply the first
+        ``candidates`` documents containing it.
+        """
+        frequencies = self.gramFrequencies(connection, query)
+        if not frequencies:
+            return 0, False, []
+        documents = int(connection.execute("SELECT value FROM meta WHERE key = 'searchDocuments'").fetchone()[0])
+        idf = {gram: math.log(1 + documents / df) for gram, df in frequencies.items()}
+
+        selected = []
+        postings = 0
+        for gram in sorted(frequencies, key=frequencies.get):
+            if selected and (postings + frequencies[gram] > self.maxPostings or len(selected) >= self.maxGrams):
+                break
+            selected.append(gram)
+            postings += frequencies[gram]
+
+        if postings > self.maxPostings:
+            rows = connection.execute(
+                "SELECT d.kind, d.author, d.id, d.name, d.authorName "
+                "FROM (SELECT kind, author, id FROM searchPostings WHERE gram = ? LIMIT ?) p "
+                "JOIN searchDocuments d ON d.kind = p.kind AND d.author = p.author AND d.id = p.id",
+                (selected[0], self.candidates + 1)
+            ).fetchall()
+        else:
+            rows = connection.execute(
+                f"WITH q (gram, idf) AS (VALUES {', '.join(['(?, ?)'] * len(selected))}), "
+                "top AS (SELECT p.kind, p.author, p.id, SUM(p.weight * q.idf) AS score "
+                "FROM q JOIN searchPostings p ON p.gram = q.gram "
+                "GROUP BY p.kind, p.author, p.id ORDER BY score DESC LIMIT ?) "
+                "SELECT d.kind, d.author, d.id, d.name, d.authorName "
+                "FROM top JOIN searchDocuments d ON d.kind = top.kind AND d.author = top.author AND d.id = top.id",
+                [value for gram in selected for value in (gram, idf[gram])] + [self.candidates + 1]
+            ).fetchall()
+        # one more than is ranked is read only to tell whether there are more
+        capped = len(rows) > self.candidates
+        rows = rows[:self.candidates]
+
+        normalized = normalize(query).strip()
+        results = []
+        for kind, author, id, name, authorName in rows:
+            nameGrams = ngrams(name)
+            authorGrams = None
+            score = 0.0
+            for gram, weight in idf.items():
+                if gram in nameGrams:
+                    score += weight * NAME_WEIGHT
+                    continue
+                if authorGrams is None:
+                    authorGrams = ngrams(authorName)
+                if gram in authorGrams:
+                    score += weight * AUTHOR_WEIGHT
+            # prefer names that contain the whole query, then shorter (more specific) names
+            if normalized and normalized in normalize(name):
+                score *= 2
+            score /= math.sqrt(1 + len(nameGrams))
+            results.append(SearchResult(kind, author, id, name, authorName, score))
+        results.sort(key=lambda result: (-result.score, result.kind, result.author, result.id))
+        start = (max(page, 1) - 1) * pageSize
+        return len(results), capped, results[start:start + pageSize]
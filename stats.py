@@ -0,0 +1,211 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+import typing
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def lines(self) -> typing.List[str]:
+        return [f"{self.name} {self.value:g}"]
+
+
+class Gauge:
+    """
+    A value read from ``function`` whenever the stats are collected, so it costs nothing in between.
+    """
+    def __init__(self, name: str, help: str, function: typing.Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    @property
+    def value(self) -> float:
+        return self.function()
+
+    def lines(self) -> typing.List[str]:
+        return [f"{self.name} {self.value:g}"]
+
+
+class CallbackCounter(Gauge):
+    """
+    A counter that something else keeps, read from ``function`` like a :class:`Gauge`. The value must never go down.
+    """
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the ``q`` quantile.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def lines(self) -> typing.List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum:g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Timing:
+    """
+    Context manager observing its duration into a histogram.
+    """
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class NoTiming:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+noTiming = NoTiming()
+
+
+class Stats:
+    """
+    Registry of every metric of the process. While ``enabled`` is False, :meth:`time` and :meth:`observe`
+    return right away without reading the clock, so instrumented code costs next to nothing.
+    """
+    def __init__(self, enabled: bool = True, prefix: str = "disanimator_"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.get(self.prefix + name) or self.register(Counter(self.prefix + name, help))
+
+    def gauge(self, name: str, help: str, function: typing.Callable[[], float]) -> Gauge:
+        return self.register(Gauge(self.prefix + name, help, function))
+
+    def callbackCounter(self, name: str, help: str, function: typing.Callable[[], float]) -> CallbackCounter:
+        return self.register(CallbackCounter(self.prefix + name, help, function))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.get(self.prefix + name) or self.register(Histogram(self.prefix + name, help, buckets))
+
+    def time(self, histogram: Histogram):
+        return Timing(histogram) if self.enabled else noTiming
+
+    def observe(self, histogram: Histogram, value: float):
+        if self.enabled:
+            histogram.observe(value)
+
+    def inc(self, counter: Counter, amount: float = 1.0):
+        if self.enabled:
+            counter.inc(amount)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            kind = {Counter: "counter", CallbackCounter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Writes :meth:`render` to ``path`` atomically, so a scraper never reads half a file.
+        """
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+    async def writePeriodically(self, path: str, interval: float = 15.0):
+        while True:
+            await asyncio.sleep(interval)
+            if self.enabled:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.write, path)
+                except OSError:
+                    logging.getLogger("disanimator").exception(f"failed to write stats to {path}")
+
+
+class RateLimitHandler(logging.Handler):
+    """
+    Counts the waits dico logs on ``dico.http`` when a rate limit bucket is empty or a request got a 429,
+    and how long they were.
+    """
+    pattern = re.compile(r"(?:No more remaining request count|Rate limited).*waiting for ([\d.]+) second")
+
+    def __init__(self, stats: Stats):
+        super().__init__(logging.WARNING)
+        self.stats = stats
+        self.waits = stats.counter("rate_limit_waits_total", "Requests that waited for a Discord rate limit.")
+        self.seconds = stats.counter("rate_limit_wait_seconds_total", "Seconds spent waiting for Discord rate limits.")
+
+    def emit(self, record: logging.LogRecord):
+        match = self.pattern.search(record.getMessage())
+        if match is not None:
+            self.stats.inc(self.waits)
+            self.stats.inc(self.seconds, float(match.group(1)))
+
+
+stats = Stats()
+
+simulateTime = stats.histogram("simulate_seconds", "Time to simulate a whole animation, in the pool or inline.")
+compositeTime = stats.histogram("composite_seconds", "Time to composite one frame, averaged over each animation.")
+encodeTime = stats.histogram("encode_seconds", "Time to encode one frame into embed fields.")
+editTime = stats.histogram("edit_seconds", "Round trip of one message edit to Discord.")
+editFailures = stats.counter("edit_failures_total", "Message edits that raised.")
@@ -0,0 +1,449 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+import zlib
+
+from cache import LRUCache
+from engine import Codes, Project, Sprite, SpriteInProject
+from search import SearchIndex, SearchResult
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    author INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    next INTEGER NOT NULL,
+    PRIMARY KEY (author, kind)
+);
+CREATE TABLE IF NOT EXISTS sprites (
+    author INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    PRIMARY KEY (author, id)
+);
+CREATE TABLE IF NOT EXISTS projects (
+    author INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    backgroundColor TEXT NOT NULL,
+    PRIMARY KEY (author, id)
+);
+CREATE TABLE IF NOT EXISTS projectSprites (
+    author INTEGER NOT NULL,
+    project INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    sprite INTEGER NOT NULL,
+    position TEXT NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (author, project, slot)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    author INTEGER NOT NULL,
+    state BLOB NOT NULL,
+    saved REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessionsSaved ON sessions (saved);
+"""
+
+
+class Storage:
+    """
+    Projects and sprites of every user, kept in one SQLite database.
+
+    IDs are counted per author and kind, and are allocated in the same transaction as the row they belong to,
+    so concurrent saves never get the same ID and deleted rows never get their ID reused.
+
+    Parsed sprites and projects are kept in an LRU cache keyed by ``(author, kind, id)``. Cached objects are shared
+    between callers and must not be modified.
+
+    Every thread gets its own connection, so it can be used from the worker threads of :class:`AsyncStorage`.
+    Several processes can share the database too, as the workers of ``launcher.py`` do: writes are serialized by
+    ``BEGIN IMMEDIATE`` with a busy timeout, and :meth:`checkVersion` drops the cache after another process
+    changed sprites or projects. Writes of this process invalidate only the keys they touch.
+
+    Names are indexed for :meth:`search` in the same transaction that saves them.
+    """
+    def __init__(self, path: str = "data/disanimator.db", cacheBytes: int = 32 * 1024 * 1024):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.cache = LRUCache(cacheBytes)
+        self.index = SearchIndex()
+        # the generation of sprites and projects the cache is up to date with, see bump()
+        self.generationLock = threading.Lock()
+        self.generation = 0
+        self.connection.executescript(schema)
+        self.index.create(self.connection)
+        with self.transaction():
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'searchIndexed'").fetchone() is None:
+                self.index.rebuild(self.connection)
+                self.connection.execute("INSERT INTO meta (key, value) VALUES ('searchIndexed', '1')")
+            self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+            self.generation = self.readGeneration()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            # set first, switching to WAL can find the database locked by another process
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.execute("PRAGMA journal_mode = WAL")
+            self.local.connection = connection
+            self.local.dataVersion = connection.execute("PRAGMA data_version").fetchone()[0]
+            self.connections.append(connection)
+        return connection
+
+    def readGeneration(self) -> int:
+        return int(self.connection.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+
+    def bump(self):
+        """
+        Counts a change of sprites or projects in the database. Must be called inside :meth:`transaction`.
+
+        Transactions are serialized across processes, so a generation other than the last one this process wrote
+        means another process wrote in between, and the cache is dropped.
+        """
+        generation = self.readGeneration()
+        self.connection.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(generation + 1),))
+        with self.generationLock:
+            if generation != self.generation:
+                self.cache.clear()
+            self.generation = generation + 1
+
+    def checkVersion(self):
+        """
+        Drops the cache when another process has changed sprites or projects since the last check.
+        ``PRAGMA data_version`` tells cheaply whether any other connection committed at all,
+        which includes the other threads of this process and writes of sessions; only then the generation is read.
+        """
+        dataVersion = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if dataVersion == self.local.dataVersion:
+            return
+        self.local.dataVersion = dataVersion
+        generation = self.readGeneration()
+        with self.generationLock:
+            # one behind is a bump of this process that is not committed yet
+            if generation not in (self.generation, self.generation - 1):
+                self.cache.clear()
+                self.generation = generation
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def allocate(self, author: int, kind: str) -> int:
+        """
+        Takes the next ID of ``kind`` for ``author``. Must be called inside :meth:`transaction`.
+        """
+        self.connection.execute("INSERT OR IGNORE INTO counters (author, kind, next) VALUES (?, ?, 0)", (author, kind))
+        id = self.connection.execute("SELECT next FROM counters WHERE author = ? AND kind = ?", (author, kind)).fetchone()[0]
+        self.connection.execute("UPDATE counters SET next = next + 1 WHERE author = ? AND kind = ?", (author, kind))
+        return id
+
+    def reserve(self, author: int, kind: str, id: int):
+        """
+        Makes sure ``id`` is never handed out by :meth:`allocate`. Used when rows are imported with their IDs.
+        """
+        self.connection.execute(
+            "INSERT INTO counters (author, kind, next) VALUES (?, ?, ?) ON CONFLICT (author, kind) DO UPDATE SET next = MAX(next, excluded.next)",
+            (author, kind, id + 1)
+        )
+
+    def addSprite(self, author: int, sprite: Sprite, authorName: str = "") -> int:
+        with self.transaction():
+            id = self.allocate(author, "sprite")
+            self.insertSprite(author, id, sprite)
+            self.index.add(self.connection, "sprite", author, id, sprite.name, authorName)
+            self.bump()
+        self.cache.invalidate((author, "sprite", id))
+        return id
+
+    def insertSprite(self, author: int, id: int, sprite: Sprite):
+        self.connection.execute(
+            "INSERT INTO sprites (author, id, name, shape) VALUES (?, ?, ?, ?)",
+            (author, id, sprite.name, json.dumps(sprite.shape))
+        )
+
+    def hasSprite(self, author: int, id: int) -> bool:
+        return self.connection.execute("SELECT 1 FROM sprites WHERE author = ? AND id = ?", (author, id)).fetchone() is not None
+
+    def getSprite(self, author: int, id: int) -> typing.Optional[Sprite]:
+        self.checkVersion()
+        sprite = self.cache.get((author, "sprite", id))
+        if sprite is None:
+            row = self.connection.execute("SELECT name, shape FROM sprites WHERE author = ? AND id = ?", (author, id)).fetchone()
+            if row is None:
+                return None
+            sprite = self.parseSprite(author, id, row[0], row[1])
+        return sprite
+
+    def parseSprite(self, author: int, id: int, name: str, shape: str) -> Sprite:
+        sprite = Sprite.from_json({"name": name, "shape": json.loads(shape)})
+        self.cache.put((author, "sprite", id), sprite)
+        return sprite
+
+    def getSprites(self, author: int) -> typing.List[typing.Tuple[int, Sprite]]:
+        self.checkVersion()
+        rows = self.connection.execute("SELECT id, name, shape FROM sprites WHERE author = ? ORDER BY id", (author,))
+        return [(id, self.cache.get((author, "sprite", id)) or self.parseSprite(author, id, name, shape)) for id, name, shape in rows]
+
+    def addProject(self, author: int, project: Project, authorName: str = "") -> int:
+        with self.transaction():
+            id = self.allocate(author, "project")
+            self.insertProject(author, id, project.name, project.backgroundColor, [
+                (sprite.id, sprite.position, sprite.code.to_json()) for sprite in project.sprites
+            ])
+            self.index.add(self.connection, "project", author, id, project.name, authorName)
+            self.bump()
+        self.cache.invalidate((author, "project", id))
+        return id
+
+    def insertProject(self, author: int, id: int, name: str, backgroundColor: str, sprites: list):
+        self.connection.execute(
+            "INSERT INTO projects (author, id, name, backgroundColor) VALUES (?, ?, ?, ?)",
+            (author, id, name, backgroundColor)
+        )
+        self.connection.executemany(
+            "INSERT INTO projectSprites (author, project, slot, sprite, position, code) VALUES (?, ?, ?, ?, ?, ?)",
+            [(author, id, slot, sprite, json.dumps(position), json.dumps(code)) for slot, (sprite, position, code) in enumerate(sprites)]
+        )
+
+    def getProject(self, author: int, id: int) -> typing.Optional[Project]:
+        """
+        Loads a project together with all of its sprites in one query, parsing each distinct sprite once.
+        """
+        self.checkVersion()
+        project = self.cache.get((author, "project", id))
+        if project is not None:
+            return project
+        row = self.connection.execute("SELECT name, backgroundColor FROM projects WHERE author = ? AND id = ?", (author, id)).fetchone()
+        if row is None:
+            return None
+        rows = self.connection.execute(
+            "SELECT p.sprite, p.position, p.code, s.name, s.shape FROM projectSprites p "
+            "JOIN sprites s ON s.author = p.author AND s.id = p.sprite "
+            "WHERE p.author = ? AND p.project = ? ORDER BY p.slot",
+            (author, id)
+        )
+        sprites = []
+        for sprite, position, code, name, shape in rows:
+            parsed = self.cache.get((author, "sprite", sprite))
+            if parsed is None:
+                parsed = self.parseSprite(author, sprite, name, shape)
+            sprites.append(SpriteInProject(parsed, position=json.loads(position), id=sprite, code=Codes.from_json(json.loads(code))))
+        project = Project(name=row[0], backgroundColor=row[1], sprites=sprites)
+        self.cache.put((author, "project", id), project)
+        return project
+
+    def search(self, query: str, page: int = 1, pageSize: int = 10) -> typing.Tuple[int, bool, typing.List[SearchResult]]:
+        return self.index.search(self.connection, query, page, pageSize)
+
+    def saveSession(self, id: int, kind: str, author: int, state: dict, keepSeconds: float) -> int:
+        """
+        Stores the state of a hibernated editor as compressed JSON, dropping the ones saved more than ``keepSeconds`` ago.
+        Returns the number of stored sessions.
+        """
+        now = time.time()
+        data = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self.transaction():
+            self.connection.execute("DELETE FROM sessions WHERE saved < ?", (now - keepSeconds,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions (id, kind, author, state, saved) VALUES (?, ?, ?, ?, ?)",
+                (id, kind, author, data, now)
+            )
+            return self.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def takeSession(self, id: int, author: int) -> typing.Optional[typing.Tuple[str, dict]]:
+        """
+        Removes and returns ``(kind, state)`` of the session ``id`` if ``author`` saved it, so only one click can restore it.
+        """
+        with self.transaction():
+            row = self.connection.execute("SELECT kind, state FROM sessions WHERE id = ? AND author = ?", (id, author)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (id,))
+        return row[0], json.loads(zlib.decompress(row[1]).decode("utf-8"))
+
+    def hasSession(self, id: int, author: int) -> bool:
+        """
+        Whether ``author`` saved the session ``id``, checked without taking the write lock like :meth:`takeSession` does.
+        """
+        return self.connection.execute("SELECT 1 FROM sessions WHERE id = ? AND author = ?", (id, author)).fetchone() is not None
+
+    def countSessions(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def migrate(self, root: str = "data") -> int:
+        """
+        Imports the old ``{root}/sprites/{author}/{id}.json`` and ``{root}/projects/{author}/{id}.json`` files, keeping their IDs.
+        Runs only once per database; returns the number of imported files.
+        """
+        if self.connection.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is not None:
+            return 0
+        count = 0
+        with self.transaction():
+            for author, id, data in readTree(os.path.join(root, "sprites")):
+                if self.connection.execute("SELECT 1 FROM sprites WHERE author = ? AND id = ?", (author, id)).fetchone() is None:
+                    self.connection.execute(
+                        "INSERT INTO sprites (author, id, name, shape) VALUES (?, ?, ?, ?)",
+                        (author, id, data["name"], json.dumps(data["shape"]))
+                    )
+                    self.index.add(self.connection, "sprite", author, id, data["name"])
+                self.reserve(author, "sprite", id)
+                count += 1
+            for author, id, data in readTree(os.path.join(root, "projects")):
+                if self.connection.execute("SELECT 1 FROM projects WHERE author = ? AND id = ?", (author, id)).fetchone() is None:
+                    self.insertProject(author, id, data["name"], data.get("backgroundColor", "black"), [
+                        (sprite["id"], sprite.get("position", [0, 0]), sprite["code"]) for sprite in data["sprites"]
+                    ])
+                    self.index.add(self.connection, "project", author, id, data["name"])
+                self.reserve(author, "project", id)
+                count += 1
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (str(count),))
+            self.bump()
+        self.cache.clear()
+        return count
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections.clear()
+        self.local = threading.local()
+
+
+class Latency:
+    """
+    Running count, total and maximum of an operation's latency, plus a window of recent samples for percentiles.
+    """
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max
+        }
+
+
+class AsyncStorage:
+    """
+    :class:`Storage` for coroutines. Every call runs on a bounded thread pool so disk access never blocks the event loop,
+    and its latency (including the time spent waiting for a free worker) is recorded per operation.
+    """
+    def __init__(self, storage: Storage, workers: int = 4):
+        self.storage = storage
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage")
+        self.latencies = collections.defaultdict(Latency)
+
+    async def run(self, operation: str, function: typing.Callable, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.latencies[operation].add(time.perf_counter() - start)
+
+    async def addSprite(self, author: int, sprite: Sprite, authorName: str = "") -> int:
+        return await self.run("addSprite", self.storage.addSprite, author, sprite, authorName)
+
+    async def hasSprite(self, author: int, id: int) -> bool:
+        return await self.run("hasSprite", self.storage.hasSprite, author, id)
+
+    async def getSprite(self, author: int, id: int) -> typing.Optional[Sprite]:
+        return await self.run("getSprite", self.storage.getSprite, author, id)
+
+    async def getSprites(self, author: int) -> typing.List[typing.Tuple[int, Sprite]]:
+        return await self.run("getSprites", self.storage.getSprites, author)
+
+    async def addProject(self, author: int, project: Project, authorName: str = "") -> int:
+        return await self.run("addProject", self.storage.addProject, author, project, authorName)
+
+    async def getProject(self, author: int, id: int) -> typing.Optional[Project]:
+        return await self.run("getProject", self.storage.getProject, author, id)
+
+    async def search(self, query: str, page: int = 1, pageSize: int = 10) -> typing.Tuple[int, bool, typing.List[SearchResult]]:
+        return await self.run("search", self.storage.search, query, page, pageSize)
+
+    async def saveSession(self, id: int, kind: str, author: int, state: dict, keepSeconds: float) -> int:
+        return await self.run("saveSession", self.storage.saveSession, id, kind, author, state, keepSeconds)
+
+    async def hasSession(self, id: int, author: int) -> bool:
+        return await self.run("hasSession", self.storage.hasSession, id, author)
+
+    async def takeSession(self, id: int, author: int) -> typing.Optional[typing.Tuple[str, dict]]:
+        return await self.run("takeSession", self.storage.takeSession, id, author)
+
+    def stats(self) -> dict:
+        return {
+            "operations": {operation: latency.stats() for operation, latency in self.latencies.items()},
+            "cache": self.storage.cache.stats()
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.storage.close()
+
+
+class Transaction:
+    """
+    ``BEGIN IMMEDIATE`` ... ``COMMIT``, rolled back if the block raises.
+    """
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.connection.execute("COMMIT")
+        else:
+            self.connection.execute("ROLLBACK")
+        return False
+
+
+def readTree(path: str):
+    """
+    Yields ``(author, id, data)`` for every ``{path}/{author}/{id}.json`` file.
+    """
+    if not os.path.isdir(path):
+        return
+    for author in os.listdir(path):
+        if not author.isdecimal() or not os.path.isdir(os.path.join(path, author)):
+            continue
+        for file in os.listdir(os.path.join(path, author)):
+            name, ext = os.path.splitext(file)
+            if ext != ".json" or not name.isdecimal():
+                continue
+            with open(os.path.join(path, author, file), "r") as f:
+                yield int(author), int(name), json.load(f)